@@ -0,0 +1,134 @@
+import asyncio
+import logging
+import time
+from os import getenv
+
+from aiogram import Bot
+from aiogram.exceptions import TelegramAPIError, TelegramForbiddenError, TelegramBadRequest, TelegramRetryAfter
+
+from database import (
+    count_users,
+    create_broadcast,
+    get_user_id_chunk,
+    save_broadcast_progress,
+    get_running_broadcasts
+)
+from outbound import low_priority
+from ratelimit import TokenBucket, BucketMap, GLOBAL_RATE
+
+BROADCAST_RATE = float(getenv("BROADCAST_RATE", str(GLOBAL_RATE - 5)))
+BROADCAST_CONCURRENCY = int(getenv("BROADCAST_CONCURRENCY", "20"))
+BROADCAST_CHUNK_SIZE = int(getenv("BROADCAST_CHUNK_SIZE", "500"))
+PROGRESS_INTERVAL = 15.0
+MAX_ATTEMPTS = 5
+
+logger = logging.getLogger(__name__)
+
+_global_bucket = TokenBucket(BROADCAST_RATE)
+_chat_buckets = BucketMap()
+_jobs = {}
+
+
+class BroadcastJob:
+    def __init__(self, broadcast_id: int, text: str, chat_id: int, message_id: int, total: int,
+                 last_user_id: int = 0, sent: int = 0, failed: int = 0):
+        self.id = broadcast_id
+        self.text = text
+        self.chat_id = chat_id
+        self.message_id = message_id
+        self.total = total
+        self.last_user_id = last_user_id
+        self.sent = sent
+        self.failed = failed
+
+    def progress_text(self, done: bool = False) -> str:
+        header = "✅ Broadcast finished" if done else "📢 Broadcasting"
+        processed = self.sent + self.failed
+        return f"{header} #{self.id}\nSent: {self.sent}\nFailed: {self.failed}\nProgress: {processed}/{self.total}"
+
+
+async def _deliver(bot: Bot, user_id: int, text: str) -> bool:
+    for _ in range(MAX_ATTEMPTS):
+        await _chat_buckets.get(user_id).acquire()
+        await _global_bucket.acquire()
+        try:
+            # Broadcasts never hold up game results.
+            with low_priority():
+                await bot.send_message(user_id, text)
+            return True
+        except TelegramRetryAfter as e:
+            # A flood wait applies to the whole bot, so everyone backs off.
+            _global_bucket.pause(e.retry_after)
+        except (TelegramForbiddenError, TelegramBadRequest):
+            return False
+        except TelegramAPIError as e:
+            logger.warning("Broadcast to %s failed: %s", user_id, e)
+            return False
+    return False
+
+
+async def _report(bot: Bot, job: BroadcastJob, done: bool = False) -> None:
+    if not job.message_id:
+        return
+    try:
+        await bot.edit_message_text(job.progress_text(done), chat_id=job.chat_id, message_id=job.message_id)
+    except TelegramAPIError as e:
+        logger.debug("Could not update broadcast progress: %s", e)
+
+
+async def _run(bot: Bot, job: BroadcastJob) -> None:
+    semaphore = asyncio.Semaphore(BROADCAST_CONCURRENCY)
+    text = f"📢 {job.text}"
+
+    async def send(user_id: int) -> bool:
+        async with semaphore:
+            return await _deliver(bot, user_id, text)
+
+    last_report = time.monotonic()
+    try:
+        while True:
+            user_ids = await get_user_id_chunk(job.last_user_id, BROADCAST_CHUNK_SIZE)
+            if not user_ids:
+                break
+            results = await asyncio.gather(*(send(user_id) for user_id in user_ids))
+            delivered = sum(results)
+            job.sent += delivered
+            job.failed += len(results) - delivered
+            job.last_user_id = user_ids[-1]
+            # Progress is only saved at chunk boundaries, so a restart resends
+            # at most one chunk.
+            await save_broadcast_progress(job.id, job.last_user_id, job.sent, job.failed)
+            if time.monotonic() - last_report >= PROGRESS_INTERVAL:
+                last_report = time.monotonic()
+                await _report(bot, job)
+        await save_broadcast_progress(job.id, job.last_user_id, job.sent, job.failed, "done")
+        await _report(bot, job, done=True)
+    except Exception:
+        logger.exception("Broadcast #%s stopped", job.id)
+        await save_broadcast_progress(job.id, job.last_user_id, job.sent, job.failed, "failed")
+    finally:
+        _jobs.pop(job.id, None)
+
+
+def _spawn(bot: Bot, job: BroadcastJob) -> None:
+    _jobs[job.id] = (job, asyncio.create_task(_run(bot, job)))
+
+
+async def start_broadcast(bot: Bot, text: str, chat_id: int):
+    total = await count_users()
+    if not total:
+        return None
+    status = await bot.send_message(chat_id, f"📢 Broadcast queued for {total} users")
+    broadcast_id = await create_broadcast(text, chat_id, status.message_id, total)
+    job = BroadcastJob(broadcast_id, text, chat_id, status.message_id, total)
+    _spawn(bot, job)
+    return job
+
+
+async def resume_broadcasts(bot: Bot) -> None:
+    for row in await get_running_broadcasts():
+        if row[0] in _jobs:
+            continue
+        job = BroadcastJob(*row)
+        logger.info("Resuming broadcast #%s after user %s", job.id, job.last_user_id)
+        _spawn(bot, job)
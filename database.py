@@ -1,38 +1,577 @@
+import asyncio
 import sqlite3
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from os import getenv
 
-conn = sqlite3.connect('casino.db')
-cursor = conn.cursor()
+from leaderboard import Leaderboard
+from metrics import record_bet, timed_db
+from migrations import migrate
 
+DB_PATH = getenv("CASINO_DB", "casino.db")
+READ_POOL_SIZE = int(getenv("DB_READ_POOL_SIZE", "4"))
+GROUP_COMMIT = getenv("DB_GROUP_COMMIT", "1") != "0"
+GROUP_COMMIT_WINDOW = float(getenv("DB_GROUP_COMMIT_WINDOW", "0.005"))
+GROUP_COMMIT_MAX_OPS = int(getenv("DB_GROUP_COMMIT_MAX_OPS", "128"))
+LEADERBOARD_CACHE_SIZE = int(getenv("LEADERBOARD_CACHE_SIZE", "100"))
+LEADERBOARD_MAX_AGE = float(getenv("LEADERBOARD_MAX_AGE", "5"))
+SNAPSHOTS_KEPT = int(getenv("LEDGER_SNAPSHOTS_KEPT", "3"))
+# Other worker processes writing to the same file would make the in-memory
+# ranking reload over and over on the writer, so it is read from the balance
+# index instead.
+SHARED_DB = int(getenv("WORKERS", "1")) > 1
 
-async def init_db():    
-    cursor.execute('''CREATE TABLE IF NOT EXISTS users (
-        id INTEGER PRIMARY KEY,
-        username TEXT,
-        name TEXT,
-        balance REAL DEFAULT 1000.0
-    )''')
-    conn.commit()
+# Reads fan out over a small pool; writes go through a single thread because
+# SQLite only ever has one writer at a time anyway.
+_read_executor = ThreadPoolExecutor(max_workers=READ_POOL_SIZE, thread_name_prefix="db-read")
+_write_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="db-write")
 
+leaderboard = Leaderboard(LEADERBOARD_CACHE_SIZE)
 
-def get_user_balance(user_id: int):
-    cursor.execute("SELECT balance FROM users WHERE id = ?", (user_id,))
-    return cursor.fetchone()
+_local = threading.local()
+_data_version = None
+# Ledger rows of the batch being committed, inserted together just before
+# COMMIT. Only touched on the writer thread.
+_ledger_rows = []
+_stats_rows = []
+_synced_at = 0.0
+_connections = []
+_connections_lock = threading.Lock()
 
 
-def add_user(user_id: int, username: str, full_name: str):
-    cursor.execute("INSERT OR IGNORE INTO users (id, username, name) VALUES (?, ?, ?)", 
-                   (user_id, username, full_name))
-    conn.commit()
+def _connect() -> sqlite3.Connection:
+    conn = sqlite3.connect(DB_PATH, timeout=30, isolation_level=None, check_same_thread=False)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=FULL")
+    with _connections_lock:
+        _connections.append(conn)
+    return conn
 
 
-def update_balance(user_id: int, new_balance: float):
-    cursor.execute("UPDATE users SET balance = ? WHERE id = ?", (new_balance, user_id))
-    conn.commit()
+def _connection() -> sqlite3.Connection:
+    conn = getattr(_local, "conn", None)
+    if conn is None:
+        conn = _local.conn = _connect()
+    return conn
 
-def increment_balance(user_id: int, amount: float):
-    cursor.execute("UPDATE users SET balance = balance + ? WHERE id = ?", (amount, user_id))
-    conn.commit()
 
-def get_leaderboard(limit: int = 10):
-    cursor.execute("SELECT name, balance FROM users ORDER BY balance DESC LIMIT ?", (limit,))
-    return cursor.fetchall()
+def _fetchone(query: str, params: tuple = ()):
+    cursor = _connection().cursor()
+    try:
+        cursor.execute(query, params)
+        return cursor.fetchone()
+    finally:
+        cursor.close()
+
+
+def _fetchall(query: str, params: tuple = ()):
+    cursor = _connection().cursor()
+    try:
+        cursor.execute(query, params)
+        return cursor.fetchall()
+    finally:
+        cursor.close()
+
+
+def _execute(query: str, params: tuple = ()) -> int:
+    cursor = _connection().cursor()
+    try:
+        cursor.execute(query, params)
+        return cursor.rowcount
+    finally:
+        cursor.close()
+
+
+STATS_UPSERT = ("INSERT INTO game_stats (user_id, game, games, wagered, won, biggest_win) VALUES (?, ?, ?, ?, ?, ?) "
+                "ON CONFLICT (user_id, game) DO UPDATE SET games = games + excluded.games, "
+                "wagered = wagered + excluded.wagered, won = won + excluded.won, "
+                "biggest_win = MAX(biggest_win, excluded.biggest_win)")
+
+
+def _merge_stats(rows: list) -> list:
+    # One upsert per player and game per batch, plus the all-players row.
+    merged = {}
+    for user_id, game, games, wagered, won, biggest in rows:
+        for key in ((user_id, game), (0, game)):
+            total = merged.get(key)
+            if total is None:
+                merged[key] = [games, wagered, won, biggest]
+            else:
+                total[0] += games
+                total[1] += wagered
+                total[2] += won
+                total[3] = max(total[3], biggest)
+    return [(*key, *total) for key, total in merged.items()]
+
+
+def _commit_batch(ops: list) -> list:
+    conn = _connection()
+    results = []
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        for fn, args in ops:
+            # A failing operation only rolls back its own savepoint, the rest
+            # of the batch still commits.
+            conn.execute("SAVEPOINT op")
+            appended, counted = len(_ledger_rows), len(_stats_rows)
+            try:
+                results.append((True, fn(*args)))
+            except Exception as e:
+                conn.execute("ROLLBACK TO op")
+                del _ledger_rows[appended:]
+                del _stats_rows[counted:]
+                # The op may have moved a player in the ranking before it failed.
+                leaderboard.invalidate()
+                results.append((False, e))
+            conn.execute("RELEASE op")
+        if _ledger_rows:
+            conn.executemany("INSERT INTO ledger (user_id, kind, amount, balance, ref, created_at) "
+                             "VALUES (?, ?, ?, ?, ?, ?)", _ledger_rows)
+            _ledger_rows.clear()
+        if _stats_rows:
+            conn.executemany(STATS_UPSERT, _merge_stats(_stats_rows))
+            _stats_rows.clear()
+        conn.execute("COMMIT")
+    except BaseException:
+        _ledger_rows.clear()
+        _stats_rows.clear()
+        if conn.in_transaction:
+            conn.execute("ROLLBACK")
+        # Balance changes were already applied to the in-memory ranking.
+        leaderboard.invalidate()
+        raise
+    return results
+
+
+class GroupCommitter:
+    def __init__(self, window: float, max_ops: int):
+        self.window = window
+        self.max_ops = max_ops
+        self._pending = []
+        self._timer = None
+        self._inflight = set()
+
+    async def submit(self, fn, *args):
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self._pending.append((fn, args, future))
+        if len(self._pending) >= self.max_ops:
+            self.flush()
+        elif self._timer is None:
+            self._timer = loop.call_later(self.window, self.flush)
+        return await future
+
+    def flush(self) -> None:
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        if not self._pending:
+            return
+        batch, self._pending = self._pending, []
+        task = asyncio.get_running_loop().run_in_executor(
+            _write_executor, _commit_batch, [(fn, args) for fn, args, _ in batch]
+        )
+        self._inflight.add(task)
+        task.add_done_callback(lambda t: self._resolve(t, batch))
+
+    def _resolve(self, task, batch: list) -> None:
+        self._inflight.discard(task)
+        error = task.exception()
+        for i, (_, _, future) in enumerate(batch):
+            if future.done():
+                continue
+            if error is not None:
+                future.set_exception(error)
+                continue
+            ok, value = task.result()[i]
+            if ok:
+                future.set_result(value)
+            else:
+                future.set_exception(value)
+
+    async def drain(self) -> None:
+        self.flush()
+        if self._inflight:
+            await asyncio.wait(list(self._inflight))
+
+
+_committer = GroupCommitter(GROUP_COMMIT_WINDOW, GROUP_COMMIT_MAX_OPS if GROUP_COMMIT else 1)
+
+
+async def _read(fn, *args):
+    return await asyncio.get_running_loop().run_in_executor(_read_executor, fn, *args)
+
+
+async def _write(fn, *args):
+    # Resolves only once the transaction holding this write has committed.
+    return await _committer.submit(fn, *args)
+
+
+async def _on_writer(fn, *args):
+    # Runs outside any batch but serialised with the writes, for work that
+    # must see a stable table, such as (re)building the leaderboard.
+    return await asyncio.get_running_loop().run_in_executor(_write_executor, fn, *args)
+
+
+def _user_name(user_id: int):
+    row = _fetchone("SELECT name FROM users WHERE id = ?", (user_id,))
+    return row[0] if row else None
+
+
+def _top_rows():
+    return _fetchall("SELECT id, name, balance FROM users ORDER BY balance DESC LIMIT ?", (leaderboard.size,))
+
+
+def _load_leaderboard():
+    global _data_version
+    _data_version = _fetchone("PRAGMA data_version")[0]
+    cursor = _connection().cursor()
+    try:
+        cursor.execute("SELECT balance FROM users")
+        balances = [row[0] for row in cursor]
+    finally:
+        cursor.close()
+    leaderboard.load(balances, _top_rows())
+
+
+def _refill_leaderboard():
+    leaderboard.refill(_top_rows())
+
+
+def _sync_leaderboard():
+    # Runs on the writer, whose own commits leave data_version alone, so a
+    # change means another worker process has written to the database.
+    global _synced_at
+    _synced_at = time.monotonic()
+    if _fetchone("PRAGMA data_version")[0] != _data_version:
+        _load_leaderboard()
+
+
+def _append_ledger(user_id: int, kind: str, amount: int, balance: int, ref: str = None) -> None:
+    _ledger_rows.append((user_id, kind, amount, balance, ref, int(time.time())))
+
+
+def _change_balance(user_id: int, query: str, params: tuple, kind: str, ref: str = None):
+    old = _fetchone("SELECT balance FROM users WHERE id = ?", (user_id,))
+    if old is None:
+        return None
+    row = _fetchone(query, params)
+    if row is not None:
+        if row[0] != old[0]:
+            _append_ledger(user_id, kind, row[0] - old[0], row[0], ref)
+        leaderboard.update(user_id, old[0], row[0], _user_name)
+    return row
+
+
+def _record_stats(user_id: int, game: str, games: int = 0, wagered: int = 0, won: int = 0, biggest: int = 0):
+    if game is not None:
+        _stats_rows.append((user_id, game, games, wagered, won, biggest))
+
+
+def _place_bet(user_id: int, bet: int, game: str):
+    row = _change_balance(user_id, "UPDATE users SET balance = balance - ? WHERE id = ? AND balance >= ? "
+                                   "RETURNING balance", (bet, user_id, bet), "bet", game)
+    if row is not None:
+        _record_stats(user_id, game, games=1, wagered=bet)
+    return row
+
+
+def _settle(user_id: int, amount: int, game: str):
+    row = _change_balance(user_id, "UPDATE users SET balance = balance + ? WHERE id = ? RETURNING balance",
+                          (amount, user_id), "win", game)
+    if row is not None:
+        _record_stats(user_id, game, won=amount, biggest=amount)
+    return row
+
+
+def _settle_batch(user_id: int, bet: int, rounds: int, winnings: int, biggest: int, game: str):
+    # Both legs share the savepoint, so a batch is never half applied.
+    stake = bet * rounds
+    row = _change_balance(user_id, "UPDATE users SET balance = balance - ? WHERE id = ? AND balance >= ? "
+                                   "RETURNING balance", (stake, user_id, stake), "bet", game)
+    if row is None:
+        return row
+    _record_stats(user_id, game, games=rounds, wagered=stake, won=winnings, biggest=biggest)
+    if not winnings:
+        return row
+    return _change_balance(user_id, "UPDATE users SET balance = balance + ? WHERE id = ? RETURNING balance",
+                           (winnings, user_id), "win", game)
+
+
+def _settle_many(payouts: list, kind: str, game: str):
+    for user_id, amount in payouts:
+        row = _change_balance(user_id, "UPDATE users SET balance = balance + ? WHERE id = ? RETURNING balance",
+                              (amount, user_id), kind, game)
+        if row is None:
+            continue
+        if kind == "refund":
+            # A refunded bet is taken back out of the games played.
+            _record_stats(user_id, game, games=-1, wagered=-amount)
+        else:
+            _record_stats(user_id, game, won=amount, biggest=amount)
+
+
+def _insert_user(user_id: int, username: str, full_name: str):
+    row = _fetchone("INSERT OR IGNORE INTO users (id, username, name) VALUES (?, ?, ?) RETURNING balance",
+                    (user_id, username, full_name))
+    if row is not None:
+        _append_ledger(user_id, "signup", row[0], row[0])
+        leaderboard.add(user_id, full_name, row[0])
+
+
+def _rotate_seed(user_id: int, server_seed: str, client_seed: str, nonces: int, new_server_seed: str,
+                 new_client_seed: str):
+    _execute("INSERT INTO fairness_reveals (user_id, server_seed, client_seed, nonces, revealed_at) "
+             "VALUES (?, ?, ?, ?, ?)", (user_id, server_seed, client_seed, nonces, int(time.time())))
+    _execute("UPDATE fairness_seeds SET server_seed = ?, client_seed = ?, nonce = 0 WHERE user_id = ?",
+             (new_server_seed, new_client_seed, user_id))
+
+
+def _migrate():
+    return migrate(_connection())
+
+
+def _rebuild_query(snapshot) -> tuple:
+    # Balances as of the newest ledger row: the snapshot plus everything
+    # appended after it, so only the tail has to be replayed.
+    if snapshot is None:
+        return "SELECT user_id, SUM(amount) AS total FROM ledger GROUP BY user_id", ()
+    return ("SELECT user_id, SUM(amount) AS total FROM ("
+            "SELECT user_id, balance AS amount FROM snapshot_balances WHERE snapshot_id = ? "
+            "UNION ALL SELECT user_id, amount FROM ledger WHERE id > ?"
+            ") GROUP BY user_id", snapshot)
+
+
+def _latest_snapshot():
+    return _fetchone("SELECT id, ledger_id FROM balance_snapshots ORDER BY id DESC LIMIT 1")
+
+
+def _take_snapshot():
+    # Runs on the writer outside any batch, so the ledger cannot move while
+    # the snapshot is built.
+    conn = _connection()
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        previous = _latest_snapshot()
+        ledger_id = _fetchone("SELECT COALESCE(MAX(id), 0) FROM ledger")[0]
+        if previous is not None and previous[1] == ledger_id:
+            conn.execute("ROLLBACK")
+            return previous[0]
+        snapshot_id = _fetchone("INSERT INTO balance_snapshots (ledger_id, created_at) VALUES (?, ?) RETURNING id",
+                                (ledger_id, int(time.time())))[0]
+        query, params = _rebuild_query(previous)
+        conn.execute(f"INSERT INTO snapshot_balances (snapshot_id, user_id, balance) SELECT ?, user_id, total "
+                     f"FROM ({query})", (snapshot_id, *params))
+        conn.execute("DELETE FROM snapshot_balances WHERE snapshot_id IN "
+                     "(SELECT id FROM balance_snapshots ORDER BY id DESC LIMIT -1 OFFSET ?)", (SNAPSHOTS_KEPT,))
+        conn.execute("DELETE FROM balance_snapshots WHERE id IN "
+                     "(SELECT id FROM balance_snapshots ORDER BY id DESC LIMIT -1 OFFSET ?)", (SNAPSHOTS_KEPT,))
+        conn.execute("COMMIT")
+    except BaseException:
+        conn.execute("ROLLBACK")
+        raise
+    return snapshot_id
+
+
+def _reconcile():
+    conn = _connection()
+    # One read transaction, so users and ledger are seen at the same point.
+    conn.execute("BEGIN")
+    try:
+        snapshot = _latest_snapshot()
+        query, params = _rebuild_query(snapshot)
+        tail = _fetchone("SELECT COUNT(*) FROM ledger WHERE id > ?", (snapshot[1] if snapshot else 0,))[0]
+        mismatches = _fetchall(
+            f"SELECT users.id, users.balance, COALESCE(rebuilt.total, 0) FROM users "
+            f"LEFT JOIN ({query}) AS rebuilt "
+            f"ON rebuilt.user_id = users.id WHERE users.balance != COALESCE(rebuilt.total, 0)",
+            params
+        )
+        checked = _fetchone("SELECT COUNT(*) FROM users")[0]
+    finally:
+        conn.execute("COMMIT")
+    return {"snapshot": snapshot[0] if snapshot else None, "tail": tail, "checked": checked,
+            "mismatches": mismatches}
+
+
+@timed_db
+async def init_db():
+    # A no-op version check once the schema is current.
+    await _on_writer(_migrate)
+    await _on_writer(_load_leaderboard)
+
+
+@timed_db
+async def close_db():
+    await _committer.drain()
+    _read_executor.shutdown(wait=True)
+    _write_executor.shutdown(wait=True)
+    with _connections_lock:
+        for conn in _connections:
+            conn.close()
+        _connections.clear()
+
+
+@timed_db
+async def get_user_balance(user_id: int):
+    return await _read(_fetchone, "SELECT balance FROM users WHERE id = ?", (user_id,))
+
+
+@timed_db
+async def add_user(user_id: int, username: str, full_name: str):
+    await _write(_insert_user, user_id, username, full_name)
+
+
+@timed_db
+async def update_balance(user_id: int, new_balance: int, ref: str = None):
+    await _write(_change_balance, user_id, "UPDATE users SET balance = ? WHERE id = ? RETURNING balance",
+                 (new_balance, user_id), "admin", ref)
+
+
+@timed_db
+async def increment_balance(user_id: int, amount: int, kind: str, ref: str = None):
+    await _write(_change_balance, user_id, "UPDATE users SET balance = balance + ? WHERE id = ? RETURNING balance",
+                 (amount, user_id), kind, ref)
+
+
+@timed_db
+async def place_bet(user_id: int, bet: int, game: str = None):
+    row = await _write(_place_bet, user_id, bet, game)
+    if row is None:
+        return None
+    record_bet(bet)
+    return row[0]
+
+
+@timed_db
+async def settle(user_id: int, amount: int, game: str = None):
+    row = await _write(_settle, user_id, amount, game)
+    return row[0] if row else None
+
+
+@timed_db
+async def settle_batch(user_id: int, bet: int, rounds: int, winnings: int, game: str = None, biggest: int = 0):
+    row = await _write(_settle_batch, user_id, bet, rounds, winnings, biggest, game)
+    if row is None:
+        return None
+    record_bet(bet * rounds, rounds)
+    return row[0]
+
+
+@timed_db
+async def settle_many(payouts: list, kind: str = "win", game: str = None):
+    # [(user_id, amount), ...] credited in a single write.
+    await _write(_settle_many, payouts, kind, game)
+
+
+@timed_db
+async def get_stats(user_id: int):
+    # user_id 0 gives the totals over every player.
+    return await _read(_fetchall, "SELECT game, games, wagered, won, biggest_win FROM game_stats "
+                                  "WHERE user_id = ? ORDER BY game", (user_id,))
+
+
+@timed_db
+async def take_snapshot():
+    return await _on_writer(_take_snapshot)
+
+
+@timed_db
+async def reconcile_ledger():
+    return await _read(_reconcile)
+
+
+@timed_db
+async def get_ledger(user_id: int, limit: int = 20):
+    return await _read(_fetchall, "SELECT kind, amount, balance, ref, created_at FROM ledger "
+                                  "WHERE user_id = ? ORDER BY id DESC LIMIT ?", (user_id, limit))
+
+
+async def _ensure_leaderboard():
+    if not leaderboard.loaded:
+        await _on_writer(_load_leaderboard)
+    elif time.monotonic() - _synced_at >= LEADERBOARD_MAX_AGE:
+        await _on_writer(_sync_leaderboard)
+    elif leaderboard.needs_refill:
+        await _on_writer(_refill_leaderboard)
+
+
+@timed_db
+async def get_leaderboard(limit: int = 10, offset: int = 0):
+    rows = None
+    if not SHARED_DB:
+        await _ensure_leaderboard()
+        rows = leaderboard.page(offset, limit)
+    if rows is None:
+        rows = await _read(_fetchall, "SELECT name, balance FROM users ORDER BY balance DESC LIMIT ? OFFSET ?",
+                           (limit, offset))
+    return rows
+
+
+@timed_db
+async def get_user_rank(user_id: int):
+    result = await get_user_balance(user_id)
+    if not result:
+        return None
+    if SHARED_DB:
+        return await _read(_fetchone, "SELECT (SELECT COUNT(*) FROM users WHERE balance > ?) + 1, "
+                                      "(SELECT COUNT(*) FROM users)", (result[0],))
+    await _ensure_leaderboard()
+    return leaderboard.rank(result[0]), leaderboard.total
+
+
+@timed_db
+async def count_users():
+    return (await _read(_fetchone, "SELECT COUNT(*) FROM users"))[0]
+
+
+@timed_db
+async def get_user_id_chunk(after_id: int, limit: int):
+    rows = await _read(_fetchall, "SELECT id FROM users WHERE id > ? ORDER BY id LIMIT ?", (after_id, limit))
+    return [row[0] for row in rows]
+
+
+def _insert_broadcast(text: str, chat_id: int, message_id: int, total: int):
+    return _fetchone("INSERT INTO broadcasts (text, chat_id, message_id, total) VALUES (?, ?, ?, ?) RETURNING id",
+                     (text, chat_id, message_id, total))[0]
+
+
+@timed_db
+async def create_broadcast(text: str, chat_id: int, message_id: int, total: int):
+    return await _write(_insert_broadcast, text, chat_id, message_id, total)
+
+
+@timed_db
+async def save_broadcast_progress(broadcast_id: int, last_user_id: int, sent: int, failed: int, status: str = "running"):
+    await _write(_execute, "UPDATE broadcasts SET last_user_id = ?, sent = ?, failed = ?, status = ? WHERE id = ?",
+                 (last_user_id, sent, failed, status, broadcast_id))
+
+
+@timed_db
+async def get_running_broadcasts():
+    return await _read(_fetchall, "SELECT id, text, chat_id, message_id, total, last_user_id, sent, failed "
+                                  "FROM broadcasts WHERE status = 'running' ORDER BY id")
+
+
+@timed_db
+async def get_fairness_seed(user_id: int):
+    return await _read(_fetchone, "SELECT server_seed, client_seed, nonce FROM fairness_seeds WHERE user_id = ?",
+                       (user_id,))
+
+
+@timed_db
+async def create_fairness_seed(user_id: int, server_seed: str, client_seed: str):
+    await _write(_execute, "INSERT INTO fairness_seeds (user_id, server_seed, client_seed) VALUES (?, ?, ?)",
+                 (user_id, server_seed, client_seed))
+
+
+@timed_db
+async def advance_fairness_nonce(user_id: int, nonce: int):
+    await _write(_execute, "UPDATE fairness_seeds SET nonce = MAX(nonce, ?) WHERE user_id = ?", (nonce, user_id))
+
+
+@timed_db
+async def rotate_fairness_seed(user_id: int, server_seed: str, client_seed: str, nonces: int, new_server_seed: str,
+                               new_client_seed: str):
+    await _write(_rotate_seed, user_id, server_seed, client_seed, nonces, new_server_seed, new_client_seed)
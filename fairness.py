@@ -0,0 +1,202 @@
+import asyncio
+import hashlib
+import hmac
+import logging
+import secrets
+import struct
+from collections import OrderedDict, deque
+from contextlib import asynccontextmanager
+from os import getenv
+
+from database import get_fairness_seed, create_fairness_seed, advance_fairness_nonce, rotate_fairness_seed
+
+FAIRNESS_POOL_DEPTH = int(getenv("FAIRNESS_POOL_DEPTH", "16"))
+FAIRNESS_POOL_USERS = int(getenv("FAIRNESS_POOL_USERS", "10000"))
+# Each game gets 4 HMAC-SHA256 blocks, 32 floats: enough for a full Mines
+# shuffle, every Towers floor and a 24 symbol roulette reel.
+BLOCKS_PER_NONCE = 4
+
+logger = logging.getLogger(__name__)
+
+
+def new_server_seed() -> str:
+    return secrets.token_hex(32)
+
+
+def new_client_seed() -> str:
+    return secrets.token_hex(8)
+
+
+def commitment(server_seed: str) -> str:
+    return hashlib.sha256(server_seed.encode()).hexdigest()
+
+
+def round_floats(server_seed: str, client_seed: str, nonce: int) -> tuple:
+    key = server_seed.encode()
+    floats = []
+    for cursor in range(BLOCKS_PER_NONCE):
+        digest = hmac.new(key, f"{client_seed}:{nonce}:{cursor}".encode(), hashlib.sha256).digest()
+        floats.extend(value / 2 ** 32 for value in struct.unpack(">8I", digest))
+    return tuple(floats)
+
+
+def _generate(jobs: list) -> list:
+    return [[(nonce, round_floats(server_seed, client_seed, nonce)) for nonce in nonces]
+            for server_seed, client_seed, nonces in jobs]
+
+
+class SeedState:
+    __slots__ = ("server_seed", "client_seed", "nonce", "upcoming")
+
+    def __init__(self, server_seed: str, client_seed: str, nonce: int):
+        self.server_seed = server_seed
+        self.client_seed = client_seed
+        self.nonce = nonce
+        # (nonce, floats) for the next games, filled in the background.
+        self.upcoming = deque()
+
+    @property
+    def commitment(self) -> str:
+        return commitment(self.server_seed)
+
+
+class FairnessEngine:
+    def __init__(self, depth: int, max_users: int):
+        self.depth = depth
+        self.max_users = max_users
+        self._states = OrderedDict()
+        self._loading = {}
+        self._wanted = OrderedDict()
+        self._dealing = {}
+        self._event = None
+        self._task = None
+
+    async def _load(self, user_id: int) -> SeedState:
+        row = await get_fairness_seed(user_id)
+        if row is None:
+            row = (new_server_seed(), new_client_seed(), 0)
+            await create_fairness_seed(user_id, row[0], row[1])
+        return SeedState(*row)
+
+    async def state(self, user_id: int) -> SeedState:
+        state = self._states.get(user_id)
+        if state is not None:
+            self._states.move_to_end(user_id)
+            return state
+        future = self._loading.get(user_id)
+        if future is None:
+            future = self._loading[user_id] = asyncio.ensure_future(self._load(user_id))
+            future.add_done_callback(lambda _: self._loading.pop(user_id, None))
+        state = await asyncio.shield(future)
+        if user_id not in self._states:
+            self._states[user_id] = state
+            while len(self._states) > self.max_users:
+                self._states.popitem(last=False)
+        return self._states[user_id]
+
+    async def next_round(self, user_id: int) -> tuple:
+        return (await self.next_rounds(user_id, 1))[0]
+
+    async def next_rounds(self, user_id: int, count: int) -> list:
+        state = await self.state(user_id)
+        first = state.nonce
+        state.nonce += count
+        pooled = {}
+        while state.upcoming and state.upcoming[0][0] < state.nonce:
+            nonce, floats = state.upcoming.popleft()
+            if nonce >= first:
+                pooled[nonce] = floats
+        rounds = [(nonce, pooled.get(nonce) or round_floats(state.server_seed, state.client_seed, nonce))
+                  for nonce in range(first, state.nonce)]
+        self._want(user_id)
+        # The nonce is stored before the board is used, so a restart can
+        # never deal the same board twice.
+        await advance_fairness_nonce(user_id, state.nonce)
+        return rounds
+
+    @asynccontextmanager
+    async def dealing(self, user_id: int):
+        # Held from drawing a round until its game is stored, and around seed
+        # rotation, so a seed is never revealed under a board still in play.
+        entry = self._dealing.get(user_id)
+        if entry is None:
+            entry = self._dealing[user_id] = [asyncio.Lock(), 0]
+        entry[1] += 1
+        try:
+            async with entry[0]:
+                yield
+        finally:
+            entry[1] -= 1
+            if not entry[1]:
+                del self._dealing[user_id]
+
+    async def rotate(self, user_id: int, client_seed: str = None) -> tuple:
+        state = await self.state(user_id)
+        revealed = (state.server_seed, state.client_seed, state.nonce)
+        server_seed, client_seed = new_server_seed(), client_seed or new_client_seed()
+        await rotate_fairness_seed(user_id, *revealed, server_seed, client_seed)
+        state.server_seed, state.client_seed, state.nonce = server_seed, client_seed, 0
+        state.upcoming.clear()
+        self._want(user_id)
+        return revealed
+
+    def _want(self, user_id: int) -> None:
+        if self._event is None:
+            return
+        self._wanted[user_id] = None
+        self._event.set()
+
+    def _jobs(self) -> list:
+        jobs = []
+        while self._wanted:
+            user_id, _ = self._wanted.popitem(last=False)
+            state = self._states.get(user_id)
+            if state is None:
+                continue
+            start = state.upcoming[-1][0] + 1 if state.upcoming else state.nonce
+            end = state.nonce + self.depth
+            if start < end:
+                jobs.append((user_id, state.server_seed, state.client_seed, range(start, end)))
+        return jobs
+
+    async def _refill(self) -> None:
+        while True:
+            await self._event.wait()
+            self._event.clear()
+            jobs = self._jobs()
+            if not jobs:
+                continue
+            try:
+                # The whole batch of HMACs runs in one go off the event loop.
+                results = await asyncio.to_thread(_generate, [job[1:] for job in jobs])
+            except Exception:
+                logger.exception("Fairness pool refill failed")
+                continue
+            for (user_id, server_seed, client_seed, _), rounds in zip(jobs, results):
+                state = self._states.get(user_id)
+                if state is None or (state.server_seed, state.client_seed) != (server_seed, client_seed):
+                    continue
+                while state.upcoming and state.upcoming[0][0] < state.nonce:
+                    state.upcoming.popleft()
+                for nonce, floats in rounds:
+                    expected = state.upcoming[-1][0] + 1 if state.upcoming else state.nonce
+                    if nonce == expected:
+                        state.upcoming.append((nonce, floats))
+
+    def start(self) -> None:
+        if self._task is None:
+            self._event = asyncio.Event()
+            self._task = asyncio.create_task(self._refill())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+            self._event = None
+
+
+fairness = FairnessEngine(FAIRNESS_POOL_DEPTH, FAIRNESS_POOL_USERS)
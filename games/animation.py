@@ -0,0 +1,67 @@
+import asyncio
+import logging
+from os import getenv
+
+from aiogram.exceptions import TelegramAPIError, TelegramRetryAfter
+from aiogram.types import Message, InlineKeyboardMarkup
+
+from outbound import low_priority
+from ratelimit import TokenBucket, BucketMap, GLOBAL_RATE, GROUP_RATE
+
+ANIMATION_CHAT_RATE = float(getenv("ANIMATION_CHAT_RATE", "3"))
+ANIMATION_GLOBAL_RATE = float(getenv("ANIMATION_GLOBAL_RATE", str(GLOBAL_RATE / 2)))
+
+logger = logging.getLogger(__name__)
+
+
+def _edit_rate(chat_id: int) -> float:
+    return GROUP_RATE if chat_id < 0 else ANIMATION_CHAT_RATE
+
+
+class FrameScheduler:
+    def __init__(self, chat_rate_for=_edit_rate, global_rate: float = ANIMATION_GLOBAL_RATE):
+        self._chat_buckets = BucketMap(chat_rate_for, capacity=1.0)
+        self._global_bucket = TokenBucket(global_rate)
+        self._tasks = set()
+
+    def schedule(self, message: Message, frames: list, delays: list, final_text: str,
+                 reply_markup: InlineKeyboardMarkup = None) -> None:
+        task = asyncio.create_task(self._play(message, frames, delays, final_text, reply_markup))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    def _try_spend(self, chat_id: int) -> bool:
+        chat_bucket = self._chat_buckets.get(chat_id)
+        # Check both before taking either, so a dropped frame costs nothing.
+        if chat_bucket.delay() > 0 or self._global_bucket.delay() > 0:
+            return False
+        return chat_bucket.try_acquire() and self._global_bucket.try_acquire()
+
+    async def _play(self, message: Message, frames: list, delays: list, final_text: str,
+                    reply_markup: InlineKeyboardMarkup) -> None:
+        chat_id = message.chat.id
+        try:
+            await self._chat_buckets.get(chat_id).acquire()
+            shown = frames[0]
+            sent = await message.answer(shown)
+            for frame, delay in zip(frames[1:], delays):
+                if frame != shown and self._try_spend(chat_id):
+                    try:
+                        with low_priority():
+                            await sent.edit_text(frame)
+                        shown = frame
+                    except TelegramRetryAfter as e:
+                        self._chat_buckets.get(chat_id).pause(e.retry_after)
+                    except TelegramAPIError as e:
+                        logger.debug("Dropped animation frame: %s", e)
+                await asyncio.sleep(delay)
+            await self._deliver_final(sent, final_text, reply_markup)
+        except Exception:
+            logger.exception("Animation in chat %s failed", chat_id)
+
+    async def _deliver_final(self, sent: Message, text: str, reply_markup: InlineKeyboardMarkup) -> None:
+        # Flood waits are absorbed by the outbound governor.
+        await self._chat_buckets.get(sent.chat.id).acquire()
+        await sent.edit_text(text, reply_markup=reply_markup)
+
+frame_scheduler = FrameScheduler()
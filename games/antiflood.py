@@ -0,0 +1,53 @@
+from os import getenv
+
+from aiogram import BaseMiddleware
+from aiogram.exceptions import TelegramAPIError
+from aiogram.types import CallbackQuery
+
+from games.sessions import session_key
+from metrics import Counter, register
+from ratelimit import BucketMap
+
+CALLBACK_USER_RATE = float(getenv("CALLBACK_USER_RATE", "5"))
+CALLBACK_USER_BURST = float(getenv("CALLBACK_USER_BURST", "8"))
+CALLBACK_MESSAGE_RATE = float(getenv("CALLBACK_MESSAGE_RATE", "3"))
+CALLBACK_MESSAGE_BURST = float(getenv("CALLBACK_MESSAGE_BURST", "3"))
+GAME_PREFIXES = ("mines_", "towers_")
+
+dropped = Counter("casino_callbacks_dropped_total", "Game callbacks dropped before reaching a handler.", ("reason",))
+register(dropped)
+
+
+class CallbackDebounceMiddleware(BaseMiddleware):
+    # Registered as an outer middleware, so a dropped tap costs neither the
+    # filters nor the handler, just one answerCallbackQuery.
+    def __init__(self, prefixes: tuple = GAME_PREFIXES):
+        self.prefixes = prefixes
+        self._users = BucketMap(lambda _: CALLBACK_USER_RATE, CALLBACK_USER_BURST)
+        self._messages = BucketMap(lambda _: CALLBACK_MESSAGE_RATE, CALLBACK_MESSAGE_BURST)
+        # Games whose previous tap is still being handled.
+        self._inflight = set()
+
+    async def __call__(self, handler, event: CallbackQuery, data):
+        if event.message is None or not (event.data or "").startswith(self.prefixes):
+            return await handler(event, data)
+
+        key = session_key(event.from_user.id, event.message.message_id)
+        if key in self._inflight:
+            reason = "in_flight"
+        elif not self._messages.get(key).try_acquire():
+            reason = "message_rate"
+        elif not self._users.get(event.from_user.id).try_acquire():
+            reason = "user_rate"
+        else:
+            self._inflight.add(key)
+            try:
+                return await handler(event, data)
+            finally:
+                self._inflight.discard(key)
+
+        dropped.inc(reason)
+        try:
+            await event.answer()
+        except TelegramAPIError:
+            pass
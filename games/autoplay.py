@@ -0,0 +1,52 @@
+from os import getenv
+
+from aiogram.types import Message, InlineKeyboardMarkup, InlineKeyboardButton
+from database import settle_batch
+from fairness import fairness
+from money import stars
+
+AUTOPLAY_MAX_GAMES = int(getenv("AUTOPLAY_MAX_GAMES", "50"))
+
+
+def parse_games(args: list) -> int:
+    # An optional trailing "xK" repeats the autoplay K times.
+    if not args:
+        return 1
+    if len(args) > 1 or not args[0].lower().startswith("x"):
+        raise ValueError
+    games = int(args[0][1:])
+    if not 1 <= games <= AUTOPLAY_MAX_GAMES:
+        raise ValueError
+    return games
+
+
+async def run(message: Message, game: str, bet: int, games: int, resolve, title: str) -> None:
+    # resolve(floats) plays one whole game on its board and returns
+    # (winnings, outcome line); nothing is sent until every game is decided.
+    user_id = message.from_user.id
+    played = await fairness.next_rounds(user_id, games)
+    results = [(nonce, *resolve(floats)) for nonce, floats in played]
+    winnings = sum(amount for _, amount, _ in results)
+    biggest = max(amount for _, amount, _ in results)
+
+    balance = await settle_batch(user_id, bet, games, winnings, game, biggest)
+    if balance is None:
+        await message.answer(f"Insufficient balance for {games} games of {stars(bet)}.")
+        return
+
+    stake = bet * games
+    lines = "\n".join(f"🎲 {nonce}: {outcome} → {stars(amount)}" for nonce, amount, outcome in results)
+    text = (
+        f"🤖 {title}\n\n{lines}\n\n"
+        f"Games: {games}\n"
+        f"Staked: {stars(stake)}\n"
+        f"Returned: {stars(winnings)}\n"
+        f"Net: {stars(winnings - stake, signed=True)}\n"
+        f"Balance: {stars(balance)}"
+    )
+    play_again_keyboard = InlineKeyboardMarkup(
+        inline_keyboard=[[
+            InlineKeyboardButton(text="🎮 Play Again", switch_inline_query_current_chat=message.text)
+        ]]
+    )
+    await message.answer(text, reply_markup=play_again_keyboard)
@@ -1,20 +1,96 @@
-import random
+import asyncio
+from functools import lru_cache
 from aiogram.types import Message, InlineKeyboardMarkup, InlineKeyboardButton, CallbackQuery
-from database import get_user_balance, update_balance, increment_balance, cursor, conn
+from database import get_user_balance, place_bet, settle
+from fairness import fairness
+from money import parse_amount, stars
+from games import autoplay
+from games.sessions import Session, sessions
+
+TILES = 25
+KEYBOARD_CACHE_SIZE = 4096
+
+
+def _multiplier(mines: int, reveals: int) -> float:
+    multiplier = 1.0
+    for i in range(reveals):
+        multiplier *= (TILES - i) / (TILES - mines - i)
+    return multiplier * (1 - 0.03 * mines)
+
+
+# MULTIPLIERS[mines][reveals], computed in the same order as the per-click
+# loop it replaces so payouts round exactly as before.
+MULTIPLIERS = [[_multiplier(mines, reveals) for reveals in range(TILES - mines + 1)] for mines in range(TILES)]
+
+
+class MinesSession(Session):
+    __slots__ = ("bet", "mines", "board", "revealed", "reveals", "game_over")
+
+    def __init__(self, bet: int, mines: int, board: int):
+        super().__init__()
+        self.bet = bet
+        self.mines = mines
+        self.board = board
+        self.revealed = 0
+        self.reveals = 0
+        self.game_over = False
+
+    @property
+    def multiplier(self) -> float:
+        return MULTIPLIERS[self.mines][self.reveals]
+
+    @property
+    def winnings(self) -> int:
+        if not self.reveals:
+            return self.bet
+        return int(self.bet * self.multiplier)
+
+    def reveal(self, tile: int) -> bool:
+        bit = 1 << tile
+        self.revealed |= bit
+        if self.board & bit:
+            self.game_over = True
+            return False
+        self.reveals += 1
+        return True
+
+
+def generate_board(mines: int, floats) -> int:
+    # Partial Fisher-Yates shuffle driven by the round's fair floats.
+    tiles = list(range(TILES))
+    board = 0
+    for i in range(mines):
+        j = i + int(floats[i] * (TILES - i))
+        tiles[i], tiles[j] = tiles[j], tiles[i]
+        board |= 1 << tiles[i]
+    return board
+
+
+def autoplay_round(bet: int, mines: int, picks: int, floats) -> tuple:
+    # Tiles are picked in reading order; every pick is as likely to be safe
+    # as any other, and /verify shows exactly which ones were bombs.
+    game_state = MinesSession(bet, mines, generate_board(mines, floats))
+    for tile in range(picks):
+        if not game_state.reveal(tile):
+            return 0, f"💣 on pick {tile + 1}"
+    return game_state.winnings, f"✅ {picks} safe, {game_state.multiplier:.2f}x"
 
-active_games = {}
 
 async def mines_command(message: Message) -> None:
     args = message.text.split()
     
     if len(args) < 3:
-        await message.answer("Usage: /mines <bet_amount> <mines_amount>\nExample: /mines 100 5")
+        await message.answer("Usage: /mines <bet_amount> <mines_amount> [auto <picks> [xGAMES]]\nExample: /mines 100 5\nAutoplay: /mines 100 5 auto 8 x10")
         return
     
     try:
-        bet = int(args[1])
+        bet = parse_amount(args[1])
         mines = int(args[2])
         
+        if bet <= 0:
+            await message.answer("Bet must be positive.")
+            return
+        
         if mines < 1 or mines > 24:
             await message.answer("Mines amount must be between 1 and 24.")
             return
@@ -22,6 +98,22 @@ async def mines_command(message: Message) -> None:
         await message.answer("Invalid bet amount or mines amount. Please enter numbers.")
         return
     
+    if len(args) > 3:
+        try:
+            if args[3].lower() != "auto":
+                raise ValueError
+            picks = int(args[4])
+            if not 1 <= picks <= TILES - mines:
+                raise ValueError
+            games = autoplay.parse_games(args[5:])
+        except (IndexError, ValueError):
+            await message.answer(f"Autoplay: /mines <bet> <mines> auto <picks> [xGAMES], picks 1-{TILES - mines}, "
+                                 f"up to x{autoplay.AUTOPLAY_MAX_GAMES}")
+            return
+        await autoplay.run(message, "mines", bet, games, lambda floats: autoplay_round(bet, mines, picks, floats),
+                           f"Mines autoplay: {mines} mines, {picks} picks, {stars(bet)} a game")
+        return
+    
     await start_new_mines_game(message, bet, mines)
 
 
@@ -29,47 +121,41 @@ async def start_new_mines_game(message: Message, bet: int, mines: int, user_id:
     if user_id is None:
         user_id = message.from_user.id
     
-    result = get_user_balance(user_id)
-    if not result or result[0] < bet:
-        await message.answer("Insufficient balance.")
-        return
-    
-    increment_balance(user_id, -bet)
-    
-    towers_board = [True] * mines + [False] * (25 - mines)
-    random.shuffle(towers_board)
-
-    game_state = {
-        "user_id": user_id,
-        "bet": bet,
-        "mines": mines,
-        "board": towers_board,
-        "game_over": False,
-        "winnings": bet,
-        "revealed": set()
-    }
-    
-    keyboard = create_mines_keyboard(game_state)
-    game_msg = await message.answer(
-        f"🗼 Mines Game Started!\nMines: {mines}\nBet: ⭐{bet}\nWinnings: ⭐{bet}\n\nClick tiles to reveal. Hit a mine = lose!",
-        reply_markup=keyboard
-    )
-    
-    game_key = f"{user_id}_{game_msg.message_id}"
-    active_games[game_key] = game_state
+    async with fairness.dealing(user_id):
+        if sessions.live(user_id) >= sessions.per_user:
+            await message.answer(f"You already have {sessions.per_user} games in play, finish one first.")
+            return
+        if sessions.full():
+            await message.answer("Too many games are in play right now, try again in a moment.")
+            return
+        # Claimed together with the bet so both usually share one commit.
+        balance, (nonce, floats) = await asyncio.gather(place_bet(user_id, bet, "mines"),
+                                                        fairness.next_round(user_id))
+        if balance is None:
+            await message.answer("Insufficient balance.")
+            return
+        
+        game_state = MinesSession(bet, mines, generate_board(mines, floats))
+        
+        keyboard = create_mines_keyboard(game_state)
+        game_msg = await message.answer(
+            f"🗼 Mines Game Started!\nMines: {mines}\nBet: {stars(bet)}\nWinnings: {stars(bet)}\n\nClick tiles to reveal. Hit a mine = lose!\n🎲 Nonce: {nonce}",
+            reply_markup=keyboard
+        )
+        
+        sessions.put(user_id, game_msg.message_id, game_state)
 
 
 
 async def mines_callback(callback_query: CallbackQuery) -> None:
     user_id = callback_query.from_user.id
     msg_id = callback_query.message.message_id
-    game_key = f"{user_id}_{msg_id}"
+    game_state = sessions.get(user_id, msg_id)
     
-    if game_key not in active_games:
+    if not isinstance(game_state, MinesSession):
         await callback_query.answer("Game not found or expired.", show_alert=True)
         return
     
-    game_state = active_games[game_key]
     data = callback_query.data
     
     if data == "mines_noop":
@@ -80,23 +166,28 @@ async def mines_callback(callback_query: CallbackQuery) -> None:
     
     if action == "newgame":
         await callback_query.answer()
-        del active_games[game_key]
-        await start_new_mines_game(callback_query.message, game_state["bet"], game_state["mines"], user_id)
+        sessions.pop(user_id, msg_id)
+        await start_new_mines_game(callback_query.message, game_state.bet, game_state.mines, user_id)
         return
     
-    if game_state["game_over"]:
+    if game_state.game_over:
         await callback_query.answer("Game over! Start a new game.", show_alert=True)
         return
     
     if action == "cashout":
-        winnings = game_state["winnings"]
-        increment_balance(user_id, winnings)
+        winnings = game_state.winnings
+        # Ended before the credit is awaited, so a second cashout cannot pay twice.
+        game_state.game_over = True
+        try:
+            balance = await settle(user_id, winnings, "mines")
+        except Exception:
+            game_state.game_over = False
+            raise
         
-        text = f"💰 Cashed out!\nWinnings: ⭐{winnings}\nBalance: ⭐{get_user_balance(user_id)[0]}"
-        game_state["game_over"] = True
+        text = f"💰 Cashed out!\nWinnings: {stars(winnings)}\nBalance: {stars(balance)}"
         keyboard = create_mines_keyboard(game_state)
         await callback_query.message.edit_text(text, reply_markup=keyboard)
-        await callback_query.answer(f"Won ⭐{winnings}!")
+        await callback_query.answer(f"Won {stars(winnings)}!")
         return
     
     try:
@@ -105,80 +196,65 @@ async def mines_callback(callback_query: CallbackQuery) -> None:
         await callback_query.answer()
         return
     
-    if game_state["game_over"]:
+    if game_state.game_over:
         await callback_query.answer()
         return
     
-    if tile in game_state["revealed"]:
-        await callback_query.answer("Tile already revealed!", show_alert=True)
+    if not 0 <= tile < TILES:
+        await callback_query.answer()
         return
     
-    hit_bomb = game_state["board"][tile]
+    bit = 1 << tile
     
-    game_state["revealed"].add(tile)
+    if game_state.revealed & bit:
+        await callback_query.answer("Tile already revealed!", show_alert=True)
+        return
     
-    if hit_bomb:
-        game_state["game_over"] = True
-        
-        text = f"💣 BOOM! You hit a bomb!\nLost: ⭐{game_state['bet']}\nBalance: ⭐{get_user_balance(user_id)[0]}"
+    if not game_state.reveal(tile):
+        text = f"💣 BOOM! You hit a bomb!\nLost: {stars(game_state.bet)}\nBalance: {stars((await get_user_balance(user_id))[0])}"
         
         keyboard = create_mines_keyboard(game_state)
         await callback_query.message.edit_text(text, reply_markup=keyboard)
         await callback_query.answer("You hit a bomb!")
     else:
-        multiplier = 1.0
-        for i in range(len(game_state["revealed"])):
-            multiplier *= (25 - i) / (25 - game_state["mines"] - i)
-        multiplier *= (1 - 0.03 * game_state["mines"])
-        
-        winnings = int(game_state["bet"] * multiplier)
-        game_state["winnings"] = winnings
+        multiplier = game_state.multiplier
+        winnings = game_state.winnings
 
-        text = f"🗼 Mines Game\nMines: {game_state['mines']}\nBet: ⭐{game_state['bet']}\nMultiplier: {multiplier:.2f}x\nWinnings: ⭐{winnings}\n\nClick tiles to reveal. Hit a mine = lose!"
+        text = f"🗼 Mines Game\nMines: {game_state.mines}\nBet: {stars(game_state.bet)}\nMultiplier: {multiplier:.2f}x\nWinnings: {stars(winnings)}\n\nClick tiles to reveal. Hit a mine = lose!"
         keyboard = create_mines_keyboard(game_state)
         await callback_query.message.edit_text(text, reply_markup=keyboard)
         await callback_query.answer(f"Safe! Multiplier: {multiplier:.2f}x")
 
-def create_mines_keyboard(game_state: dict) -> InlineKeyboardMarkup:
-    keyboard = []
-    board = game_state["board"]
-    game_over = game_state["game_over"]
-    
-    for row in range(5):
-        row_buttons = []
-        for col in range(5):
-            tile_idx = row * 5 + col
-            if tile_idx in game_state["revealed"] or game_over:
-                if board[tile_idx]:
-                    button_text = "💣"
-                else:
-                    button_text = "✅"
-            else:
-                button_text = "⬜"
-            
-            if not game_over:
-                row_buttons.append(
-                    InlineKeyboardButton(text=button_text, callback_data=f"mines_{tile_idx}")
-                )
-            else:
-                row_buttons.append(
-                    InlineKeyboardButton(text=button_text, callback_data="mines_noop")
-                )
-            
-        keyboard.append(row_buttons)
-    
-    action_row = []
-    
-    if game_state["game_over"]:
-        action_row.append(
-            InlineKeyboardButton(text="🔄 New Game", callback_data="mines_newgame")
-        )
+@lru_cache(maxsize=None)
+def _button(text: str, callback_data: str) -> InlineKeyboardButton:
+    return InlineKeyboardButton(text=text, callback_data=callback_data)
+
+
+@lru_cache(maxsize=None)
+def _row(row: int, pattern: int, game_over: bool) -> tuple:
+    row_buttons = []
+    for col in range(5):
+        tile_idx = row * 5 + col
+        if game_over:
+            row_buttons.append(_button("💣" if pattern >> col & 1 else "✅", "mines_noop"))
+        else:
+            # Before the game ends every revealed tile is a safe one.
+            row_buttons.append(_button("✅" if pattern >> col & 1 else "⬜", f"mines_{tile_idx}"))
+    return tuple(row_buttons)
+
+
+@lru_cache(maxsize=KEYBOARD_CACHE_SIZE)
+def _keyboard(tiles: int, game_over: bool) -> InlineKeyboardMarkup:
+    keyboard = [_row(row, tiles >> (row * 5) & 0b11111, game_over) for row in range(5)]
+    if game_over:
+        keyboard.append((_button("🔄 New Game", "mines_newgame"),))
     else:
-        action_row.append(
-            InlineKeyboardButton(text="💰 Cash Out", callback_data="mines_cashout")
-        )    
-    
-        
-    keyboard.append(action_row)
-    
+        keyboard.append((_button("💰 Cash Out", "mines_cashout"),))
     return InlineKeyboardMarkup(inline_keyboard=keyboard)
+
+
+def create_mines_keyboard(game_state: MinesSession) -> InlineKeyboardMarkup:
+    # A finished game shows the whole board, a running one only what was revealed.
+    if game_state.game_over:
+        return _keyboard(game_state.board, True)
+    return _keyboard(game_state.revealed, False)
@@ -1,8 +1,13 @@
 import asyncio
 from dataclasses import dataclass
-import random
+from os import getenv
+
+import numpy as np
 from aiogram.types import Message, InlineKeyboardMarkup, InlineKeyboardButton
-from database import get_user_balance, update_balance, increment_balance, cursor, conn
+from database import place_bet, settle, settle_batch
+from fairness import fairness
+from money import format_amount, parse_amount, stars
+from games.animation import frame_scheduler
 
 config = {
     "red_coefficient": 2,
@@ -13,19 +18,95 @@ config = {
     "yellow_probability": 0.1
 }
 
+PATTERN = ["🟥", "⬛", "🟨"]
+COLORS = ["red", "black", "yellow"]
+REEL_LENGTH = 24
+RESULT_INDEX = 19
+ROULETTE_MAX_ROUNDS = int(getenv("ROULETTE_MAX_ROUNDS", "100"))
+BATCH_ROW = 10
+
+
+def spin_reel(floats) -> list:
+    weights = [config["red_probability"], config["black_probability"], config["yellow_probability"]]
+    reel = []
+    for value in floats[:REEL_LENGTH]:
+        point = value * sum(weights)
+        for symbol, weight in zip(PATTERN, weights):
+            point -= weight
+            if point < 0:
+                break
+        reel.append(symbol)
+    return reel
+
+
+def draw(values) -> np.ndarray:
+    # The same walk over the weights as spin_reel, for every value at once.
+    weights = np.array([config[f"{color}_probability"] for color in COLORS])
+    points = np.asarray(values) * weights.sum()
+    return np.minimum(np.searchsorted(np.cumsum(weights), points, side="right"), len(PATTERN) - 1)
+
+
+def parse_rounds(text: str) -> int:
+    if not text.lower().startswith("x"):
+        raise ValueError
+    rounds = int(text[1:])
+    if not 1 <= rounds <= ROULETTE_MAX_ROUNDS:
+        raise ValueError
+    return rounds
+
+
+async def play_batch(message: Message, bet: int, color: str, rounds: int) -> None:
+    user_id = message.from_user.id
+    played = await fairness.next_rounds(user_id, rounds)
+    symbols = draw([floats[RESULT_INDEX] for _, floats in played])
+    hits = int(np.count_nonzero(symbols == COLORS.index(color)))
+    payout = bet * config[f"{color}_coefficient"]
+    winnings = hits * payout
+
+    # Every stake and the total payout land in one transaction.
+    balance = await settle_batch(user_id, bet, rounds, winnings, "roulette", payout if hits else 0)
+    if balance is None:
+        await message.answer(f"Insufficient balance for {rounds} spins of {stars(bet)}.")
+        return
+
+    reel = [PATTERN[symbol] for symbol in symbols]
+    grid = "\n".join("".join(reel[i:i + BATCH_ROW]) for i in range(0, rounds, BATCH_ROW))
+    stake = bet * rounds
+    text = (
+        f"🎰 {rounds} spins on {PATTERN[COLORS.index(color)]}, {stars(bet)} each\n\n{grid}\n\n"
+        f"Hits: {hits}/{rounds}\n"
+        f"Staked: {stars(stake)}\n"
+        f"Returned: {stars(winnings)}\n"
+        f"Net: {stars(winnings - stake, signed=True)}\n"
+        f"Balance: {stars(balance)}\n"
+        f"🎲 Nonces: {played[0][0]}-{played[-1][0]}"
+    )
+    play_again_keyboard = InlineKeyboardMarkup(
+        inline_keyboard=[[
+            InlineKeyboardButton(text="🎮 Play Again",
+                                 switch_inline_query_current_chat=f"/roulette {format_amount(bet)} {color} x{rounds}")
+        ]]
+    )
+    await message.answer(text, reply_markup=play_again_keyboard)
+
+
 async def roulette_command(message: Message) -> None:
     args = message.text.split()
     
     if len(args) < 3:
-        await message.answer("Usage: /roulette <bet_amount> <color>\nColors: red (🟥), black (⬛), yellow (🟨)\nExample: /roulette 100 red")
+        await message.answer("Usage: /roulette <bet_amount> <color> [xROUNDS]\nColors: red (🟥), black (⬛), yellow (🟨)\nExample: /roulette 100 red\nBatch: /roulette 100 red x50")
         return
     
     try:
-        bet = int(args[1])
+        bet = parse_amount(args[1])
     except ValueError:
         await message.answer("Invalid bet amount. Please enter a number.")
         return
     
+    if bet <= 0:
+        await message.answer("Bet must be positive.")
+        return
+    
     color_input = args[2].lower()
     color_map = {
         "red": "🟥",
@@ -39,30 +120,28 @@ async def roulette_command(message: Message) -> None:
     
     bet_color = color_map[color_input]
     
-    result = get_user_balance(message.from_user.id)
-    if not result or result[0] < bet:
-        await message.answer("Insufficient balance.")
+    if len(args) > 3:
+        try:
+            rounds = parse_rounds(args[3])
+        except ValueError:
+            await message.answer(f"Rounds must look like x10, between x1 and x{ROULETTE_MAX_ROUNDS}.")
+            return
+        await play_batch(message, bet, color_input, rounds)
         return
     
-    increment_balance(message.from_user.id, -bet)
+    balance, (nonce, floats) = await asyncio.gather(
+        place_bet(message.from_user.id, bet, "roulette"), fairness.next_round(message.from_user.id)
+    )
+    if balance is None:
+        await message.answer("Insufficient balance.")
+        return
     
-    pattern = ["🟥", "⬛", "🟨"]
-    spin = random.choices(pattern, k=24, weights=[config["red_probability"], config["black_probability"], config["yellow_probability"]])
+    spin = spin_reel(floats)
     
     spin[16] = bet_color
     
-    line = "".join(spin[:9]) + "\n➖➖➖➖🔺➖➖➖➖"
-    spinning_msg = await message.answer(line)
     result_symbol = spin[19]
     
-    for i in range(1, 16):
-        newline = "".join(spin[i:i+9]) + "\n➖➖➖➖🔺➖➖➖➖"
-        if line != newline:
-            await spinning_msg.edit_text(newline)
-            line = newline
-        await asyncio.sleep(0.05 + i * 0.025)
-    await asyncio.sleep(0.5)
-    
     winnings = 0
     if result_symbol == bet_color:
         if bet_color == "🟥":
@@ -71,15 +150,19 @@ async def roulette_command(message: Message) -> None:
             winnings = bet * config["black_coefficient"]
         elif bet_color == "🟨":
             winnings = bet * config["yellow_coefficient"]
-        increment_balance(message.from_user.id, winnings)
-        result_text = f"🎉 You won ⭐{winnings}!\nBalance: ⭐{get_user_balance(message.from_user.id)[0]}"
+        balance = await settle(message.from_user.id, winnings, "roulette")
+        result_text = f"🎉 You won {stars(winnings)}!\nBalance: {stars(balance)}"
     else:
-        result_text = f"😞 You lost ⭐{bet}.\nBalance: ⭐{get_user_balance(message.from_user.id)[0]}"
+        result_text = f"😞 You lost {stars(bet)}.\nBalance: {stars(balance)}"
+    result_text += f"\n🎲 Nonce: {nonce}"
     
     play_again_keyboard = InlineKeyboardMarkup(
         inline_keyboard=[[
-            InlineKeyboardButton(text="🎮 Play Again", switch_inline_query_current_chat=f"/roulette {bet} {color_input}")
+            InlineKeyboardButton(text="🎮 Play Again", switch_inline_query_current_chat=f"/roulette {format_amount(bet)} {color_input}")
         ]]
     )
     
-    await spinning_msg.edit_text(f"{line}\n\n{result_text}", reply_markup=play_again_keyboard)
+    frames = ["".join(spin[i:i+9]) + "\n➖➖➖➖🔺➖➖➖➖" for i in range(16)]
+    delays = [0.05 + i * 0.025 for i in range(1, 16)]
+    delays[-1] += 0.5
+    frame_scheduler.schedule(message, frames, delays, f"{frames[-1]}\n\n{result_text}", play_again_keyboard)
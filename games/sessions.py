@@ -0,0 +1,137 @@
+import sys
+import time
+from collections import OrderedDict
+from os import getenv
+
+from metrics import Gauge, register
+
+SESSION_TTL = float(getenv("SESSION_TTL", "1800"))
+SESSION_MAX = int(getenv("SESSION_MAX", "100000"))
+SESSIONS_PER_USER = int(getenv("SESSIONS_PER_USER", "5"))
+METRICS_SAMPLE = 100
+
+
+def session_key(user_id: int, message_id: int) -> int:
+    return (user_id << 32) | message_id
+
+
+class Session:
+    __slots__ = ("touched",)
+
+    def __init__(self):
+        self.touched = time.monotonic()
+
+
+class SessionStore:
+    def __init__(self, ttl: float = SESSION_TTL, max_size: int = SESSION_MAX, per_user: int = SESSIONS_PER_USER):
+        self.ttl = ttl
+        self.max_size = max_size
+        self.per_user = per_user
+        # Least recently used first, so idle sessions are always at the front.
+        self._sessions = OrderedDict()
+        self._user_keys = {}
+        self.evicted = 0
+
+    def get(self, user_id: int, message_id: int):
+        key = session_key(user_id, message_id)
+        session = self._sessions.get(key)
+        if session is None:
+            return None
+        now = time.monotonic()
+        if now - session.touched > self.ttl:
+            self._remove(key)
+            self.evicted += 1
+            return None
+        session.touched = now
+        self._sessions.move_to_end(key)
+        return session
+
+    def put(self, user_id: int, message_id: int, session: Session) -> None:
+        self.expire()
+        key = session_key(user_id, message_id)
+        if key in self._sessions:
+            self._remove(key)
+        # Only finished games make room. A live one holds a stake that is
+        # already taken, so new games are refused before the bet instead.
+        user_keys = self._user_keys.get(user_id, [])
+        finished = [key for key in user_keys if getattr(self._sessions[key], "game_over", False)]
+        for old in finished[:max(0, len(user_keys) - self.per_user + 1)]:
+            self._remove(old)
+            self.evicted += 1
+        excess = len(self._sessions) - self.max_size + 1
+        if excess > 0:
+            finished = [key for key, old in self._sessions.items() if getattr(old, "game_over", False)]
+            for old in finished[:excess]:
+                self._remove(old)
+                self.evicted += 1
+        session.touched = time.monotonic()
+        self._sessions[key] = session
+        self._user_keys.setdefault(user_id, []).append(key)
+
+    def pop(self, user_id: int, message_id: int):
+        key = session_key(user_id, message_id)
+        session = self._sessions.get(key)
+        if session is not None:
+            self._remove(key)
+        return session
+
+    def expire(self) -> None:
+        deadline = time.monotonic() - self.ttl
+        while self._sessions:
+            key, session = next(iter(self._sessions.items()))
+            if session.touched >= deadline:
+                break
+            self._remove(key)
+            self.evicted += 1
+
+    def active(self) -> int:
+        self.expire()
+        return len(self._sessions)
+
+    def live(self, user_id: int) -> int:
+        # Games of this player that can still be played, their stakes are taken.
+        self.expire()
+        return sum(1 for key in self._user_keys.get(user_id, ())
+                   if not getattr(self._sessions[key], "game_over", False))
+
+    def full(self) -> bool:
+        # Full of games still in play, with no finished one left to make room.
+        return self.active() >= self.max_size and self.in_play() >= self.max_size
+
+    def in_play(self) -> int:
+        # Finished games stay around until they expire so "New game" works.
+        return sum(1 for session in self._sessions.values() if not getattr(session, "game_over", False))
+
+    def _remove(self, key: int) -> None:
+        del self._sessions[key]
+        user_id = key >> 32
+        user_keys = self._user_keys[user_id]
+        user_keys.remove(key)
+        if not user_keys:
+            del self._user_keys[user_id]
+
+    def __len__(self) -> int:
+        return len(self._sessions)
+
+    def _sizeof(self, session: Session) -> int:
+        size = sys.getsizeof(session)
+        for cls in type(session).__mro__:
+            for slot in getattr(cls, "__slots__", ()):
+                size += sys.getsizeof(getattr(session, slot, None))
+        return size
+
+    def metrics(self) -> dict:
+        active = self.active()
+        sample = [session for _, session in zip(range(METRICS_SAMPLE), reversed(self._sessions.values()))]
+        per_session = sum(self._sizeof(session) for session in sample) / len(sample) if sample else 0
+        return {
+            "sessions": active,
+            "users": len(self._user_keys),
+            "evicted": self.evicted,
+            "approx_bytes": int(per_session * len(self._sessions))
+        }
+
+
+sessions = SessionStore()
+register(Gauge("casino_sessions", "Mines and Towers sessions held in memory.", sessions.active))
+register(Gauge("casino_active_sessions", "Mines and Towers games still in play.", sessions.in_play))
@@ -0,0 +1,216 @@
+import asyncio
+import logging
+from collections import defaultdict
+from os import getenv
+
+from aiogram.exceptions import TelegramAPIError
+from aiogram.types import Message
+from database import place_bet, settle_many
+from fairness import commitment, new_server_seed, round_floats
+from money import parse_amount, stars
+from games.animation import frame_scheduler
+from games.roulette import COLORS, PATTERN, RESULT_INDEX, config, spin_reel
+
+ROULETTE_TABLE_WINDOW = float(getenv("ROULETTE_TABLE_WINDOW", "15"))
+ROULETTE_TABLE_MAX_BETS = int(getenv("ROULETTE_TABLE_MAX_BETS", "100"))
+# Seconds between refreshes of the open table message; 20 messages a minute
+# is all a group gets.
+TABLE_REFRESH = 3.0
+TABLE_LINES_SHOWN = 40
+SETTLE_ATTEMPTS = 3
+
+logger = logging.getLogger(__name__)
+
+
+class TableRound:
+    __slots__ = ("chat_id", "server_seed", "bets", "message", "closed", "refresh", "task")
+
+    def __init__(self, chat_id: int):
+        self.chat_id = chat_id
+        self.server_seed = new_server_seed()
+        # (user_id, name, amount, color) in the order they were placed.
+        self.bets = []
+        self.message = None
+        self.closed = False
+        self.refresh = None
+        self.task = None
+
+    def lines(self, payouts: list = None) -> str:
+        lines = []
+        for i, (_, name, amount, color) in enumerate(self.bets[:TABLE_LINES_SHOWN]):
+            line = f"{name}: {stars(amount)} on {PATTERN[COLORS.index(color)]}"
+            if payouts is not None:
+                line += f" → {stars(payouts[i])}" if payouts[i] else " ✖"
+            lines.append(line)
+        if len(self.bets) > TABLE_LINES_SHOWN:
+            lines.append(f"…and {len(self.bets) - TABLE_LINES_SHOWN} more bets")
+        return "\n".join(lines)
+
+    def board_text(self, window: float) -> str:
+        total = sum(amount for _, _, amount, _ in self.bets)
+        return (
+            f"🎰 Roulette table open for {window:g}s\n"
+            f"Bet with /roulette <bet> <color>\n"
+            f"Seed hash: {commitment(self.server_seed)}\n\n"
+            f"{self.lines()}\n\n"
+            f"Bets: {len(self.bets)}, total {stars(total)}"
+        )
+
+    def stakes(self) -> list:
+        # One entry per bet, so stats can take each refunded game back out.
+        return [(user_id, amount) for user_id, _, amount, _ in self.bets]
+
+
+class RouletteTables:
+    def __init__(self, window: float = ROULETTE_TABLE_WINDOW):
+        self.window = window
+        self._rounds = {}
+        self._tasks = set()
+
+    def _spawn(self, coro) -> asyncio.Task:
+        task = asyncio.create_task(coro)
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+        return task
+
+    async def _credit(self, payouts: list, kind: str) -> bool:
+        # A table settles many players at once, so a failed write is retried
+        # before anyone is left without their stake or win.
+        for attempt in range(SETTLE_ATTEMPTS):
+            try:
+                await settle_many(payouts, kind, "roulette")
+                return True
+            except Exception:
+                logger.warning("Roulette table %s of %d entries failed, attempt %d",
+                               kind, len(payouts), attempt + 1, exc_info=True)
+                if attempt < SETTLE_ATTEMPTS - 1:
+                    await asyncio.sleep(2 ** attempt)
+        return False
+
+    async def _refund(self, table_round: TableRound) -> bool:
+        if await self._credit(table_round.stakes(), "refund"):
+            return True
+        logger.error("Roulette table in chat %s could not refund its stakes: %s",
+                     table_round.chat_id, table_round.stakes())
+        return False
+
+    async def bet(self, message: Message, amount: int, color: str) -> None:
+        chat_id = message.chat.id
+        table_round = self._rounds.get(chat_id)
+        if table_round is not None and len(table_round.bets) >= ROULETTE_TABLE_MAX_BETS:
+            await message.reply("The table is full, wait for the next round.")
+            return
+
+        balance = await place_bet(message.from_user.id, amount, "roulette")
+        if balance is None:
+            await message.reply("Insufficient balance.")
+            return
+
+        # Looked up again: the round may have spun while the stake was taken,
+        # in which case this bet opens the next one.
+        bet = (message.from_user.id, message.from_user.full_name, amount, color)
+        table_round = self._rounds.get(chat_id)
+        if table_round is None:
+            table_round = self._rounds[chat_id] = TableRound(chat_id)
+            table_round.bets.append(bet)
+            table_round.task = self._spawn(self._run(table_round, message))
+            return
+        table_round.bets.append(bet)
+        if table_round.message is not None and table_round.refresh is None:
+            table_round.refresh = asyncio.get_running_loop().call_later(
+                TABLE_REFRESH, lambda: self._spawn(self._refresh(table_round)))
+
+    async def _refresh(self, table_round: TableRound) -> None:
+        table_round.refresh = None
+        if table_round.closed:
+            return
+        try:
+            await table_round.message.edit_text(table_round.board_text(self.window))
+        except TelegramAPIError as e:
+            logger.debug("Table refresh in chat %s failed: %s", table_round.chat_id, e)
+
+    async def _run(self, table_round: TableRound, message: Message) -> None:
+        try:
+            table_round.message = await message.answer(table_round.board_text(self.window))
+            await asyncio.sleep(self.window)
+        except TelegramAPIError as e:
+            # Nobody can see the table, so nobody should lose on it.
+            logger.warning("Roulette table in chat %s could not open: %s", table_round.chat_id, e)
+            self._close(table_round)
+            await self._refund(table_round)
+            return
+        try:
+            await self._spin(table_round)
+        except Exception:
+            logger.exception("Roulette table in chat %s failed to settle", table_round.chat_id)
+
+    def _close(self, table_round: TableRound) -> None:
+        table_round.closed = True
+        if self._rounds.get(table_round.chat_id) is table_round:
+            del self._rounds[table_round.chat_id]
+        if table_round.refresh is not None:
+            table_round.refresh.cancel()
+
+    async def _spin(self, table_round: TableRound) -> None:
+        self._close(table_round)
+
+        # The chat id is the client seed, so /verify roulette <seed> <chat_id> 0
+        # replays the round.
+        spin = spin_reel(round_floats(table_round.server_seed, str(table_round.chat_id), 0))
+        result = spin[RESULT_INDEX]
+        payouts = [amount * config[f"{color}_coefficient"] if PATTERN[COLORS.index(color)] == result else 0
+                   for _, _, amount, color in table_round.bets]
+        totals = defaultdict(int)
+        for (user_id, _, _, _), payout in zip(table_round.bets, payouts):
+            if payout:
+                totals[user_id] += payout
+        # Every winning position is credited in one transaction.
+        if totals and not await self._credit(list(totals.items()), "win"):
+            # The spin stands for no one, so every bet on it goes back.
+            if await self._refund(table_round):
+                text = f"Result: {result}\n\nPayouts could not be credited, so every bet was refunded."
+            else:
+                text = f"Result: {result}\n\nPayouts could not be credited, an admin will settle this round."
+            await table_round.message.edit_text(text)
+            return
+
+        result_text = (
+            f"Result: {result}\n\n{table_round.lines(payouts)}\n\n"
+            f"Winners: {len(totals)}, paid {stars(sum(totals.values()))}\n"
+            f"🎲 Seed: {table_round.server_seed}\nClient seed: {table_round.chat_id}, nonce 0"
+        )
+        frames = ["".join(spin[i:i+9]) + "\n➖➖➖➖🔺➖➖➖➖" for i in range(16)]
+        delays = [0.05 + i * 0.025 for i in range(1, 16)]
+        delays[-1] += 0.5
+        frame_scheduler.schedule(table_round.message, frames, delays, f"{frames[-1]}\n\n{result_text}")
+
+    async def stop(self) -> None:
+        # Rounds still taking bets never spin after a restart, so their stakes
+        # go back; rounds already spinning are left to finish.
+        open_rounds = list(self._rounds.values())
+        for table_round in open_rounds:
+            self._close(table_round)
+            table_round.task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        for table_round in open_rounds:
+            await self._refund(table_round)
+
+
+tables = RouletteTables()
+
+
+async def table_command(message: Message) -> None:
+    args = message.text.split()
+    if len(args) != 3 or args[2].lower() not in COLORS:
+        await message.reply("Usage: /roulette <bet_amount> <color>\nColors: red (🟥), black (⬛), yellow (🟨)\n"
+                            "Bets join the table's next shared spin.")
+        return
+    try:
+        amount = parse_amount(args[1])
+    except ValueError:
+        await message.reply("Invalid bet amount. Please enter a number.")
+        return
+    if amount <= 0:
+        await message.reply("Bet must be positive.")
+        return
+    await tables.bet(message, amount, args[2].lower())
@@ -1,8 +1,11 @@
-import random
+import asyncio
+from functools import lru_cache
 from aiogram.types import Message, InlineKeyboardMarkup, InlineKeyboardButton, CallbackQuery
-from database import get_user_balance, update_balance, increment_balance, cursor, conn
-
-active_games = {}
+from database import get_user_balance, place_bet, settle
+from fairness import fairness
+from money import parse_amount, stars
+from games import autoplay
+from games.sessions import Session, sessions
 
 DIFFICULTIES = {
     "easy": {"columns": 3, "bombs": 1, "multiplier_per_floor": 1.4},
@@ -11,24 +14,118 @@ DIFFICULTIES = {
 }
 
 
+FLOORS = 5
+KEYBOARD_CACHE_SIZE = 4096
+
+
+def _floor_multipliers(multiplier_per_floor: float) -> list:
+    multipliers = [1.0]
+    for _ in range(FLOORS):
+        multipliers.append(multipliers[-1] * multiplier_per_floor)
+    return multipliers
+
+
+# FLOOR_MULTIPLIERS[difficulty][floors_cleared], accumulated the same way the
+# per-click multiplication did so payouts round exactly as before.
+FLOOR_MULTIPLIERS = {
+    name: _floor_multipliers(config["multiplier_per_floor"]) for name, config in DIFFICULTIES.items()
+}
+
+
+class TowersSession(Session):
+    __slots__ = ("bet", "difficulty", "board", "floor", "game_over")
+
+    def __init__(self, bet: int, difficulty: str, board: int):
+        super().__init__()
+        self.bet = bet
+        self.difficulty = difficulty
+        self.board = board
+        self.floor = FLOORS - 1
+        self.game_over = False
+
+    @property
+    def columns(self) -> int:
+        return DIFFICULTIES[self.difficulty]["columns"]
+
+    @property
+    def multiplier(self) -> float:
+        return FLOOR_MULTIPLIERS[self.difficulty][FLOORS - 1 - self.floor]
+
+    @property
+    def winnings(self) -> int:
+        return int(self.bet * self.multiplier)
+
+    def climb(self, tile: int) -> bool:
+        if self.board >> tile & 1:
+            self.game_over = True
+            return False
+        self.floor -= 1
+        return True
+
+
+def generate_board(difficulty: str, floats) -> int:
+    # A partial Fisher-Yates shuffle per floor, driven by the round's fair floats.
+    config = DIFFICULTIES[difficulty]
+    columns = config["columns"]
+    board = 0
+    values = iter(floats)
+    for row_idx in range(FLOORS):
+        cols = list(range(columns))
+        for i in range(config["bombs"]):
+            j = i + int(next(values) * (columns - i))
+            cols[i], cols[j] = cols[j], cols[i]
+            board |= 1 << (row_idx * columns + cols[i])
+    return board
+
+
+def autoplay_round(bet: int, difficulty: str, floors: int, floats) -> tuple:
+    # The leftmost tile of each floor, bottom up; /verify shows the board.
+    game_state = TowersSession(bet, difficulty, generate_board(difficulty, floats))
+    for cleared in range(floors):
+        if not game_state.climb(game_state.floor * game_state.columns):
+            return 0, f"💣 on floor {cleared + 1}"
+    return game_state.winnings, f"✅ {floors} floors, {game_state.multiplier:.1f}x"
+
+
 async def towers_command(message: Message) -> None:
     args = message.text.split()
     
     if len(args) < 2:
-        await message.answer("Usage: /towers <bet_amount> [difficulty]\nDifficulty: easy (3 cols, 1 bomb), medium (2 cols, 1 bomb), hard (3 cols, 2 bombs)\nExample: /towers 100 easy")
+        await message.answer("Usage: /towers <bet_amount> [difficulty] [auto <floors> [xGAMES]]\nDifficulty: easy (3 cols, 1 bomb), medium (2 cols, 1 bomb), hard (3 cols, 2 bombs)\nExample: /towers 100 easy\nAutoplay: /towers 100 hard auto 4 x10")
         return
     
     try:
-        bet = int(args[1])
+        bet = parse_amount(args[1])
     except ValueError:
         await message.answer("Invalid bet amount. Please enter a number.")
         return
     
+    if bet <= 0:
+        await message.answer("Bet must be positive.")
+        return
+    
     difficulty = args[2].lower() if len(args) > 2 else "easy"
     if difficulty not in DIFFICULTIES:
         await message.answer(f"Invalid difficulty. Choose: {', '.join(DIFFICULTIES.keys())}")
         return
     
+    if len(args) > 3:
+        try:
+            if args[3].lower() != "auto":
+                raise ValueError
+            floors = int(args[4])
+            if not 1 <= floors <= FLOORS:
+                raise ValueError
+            games = autoplay.parse_games(args[5:])
+        except (IndexError, ValueError):
+            await message.answer(f"Autoplay: /towers <bet> <difficulty> auto <floors> [xGAMES], floors 1-{FLOORS}, "
+                                 f"up to x{autoplay.AUTOPLAY_MAX_GAMES}")
+            return
+        await autoplay.run(message, "towers", bet, games,
+                           lambda floats: autoplay_round(bet, difficulty, floors, floats),
+                           f"Towers autoplay: {difficulty.upper()}, {floors} floors, {stars(bet)} a game")
+        return
+    
     await start_new_towers_game(message, bet, difficulty)
 
 
@@ -36,54 +133,40 @@ async def start_new_towers_game(message: Message, bet: int, difficulty: str, use
     if user_id is None:
         user_id = message.from_user.id
     
-    result = get_user_balance(user_id)
-    if not result or result[0] < bet:
-        await message.answer("Insufficient balance.")
-        return
-    
-    increment_balance(user_id, -bet)
+    async with fairness.dealing(user_id):
+        if sessions.live(user_id) >= sessions.per_user:
+            await message.answer(f"You already have {sessions.per_user} games in play, finish one first.")
+            return
+        if sessions.full():
+            await message.answer("Too many games are in play right now, try again in a moment.")
+            return
+        balance, (nonce, floats) = await asyncio.gather(place_bet(user_id, bet, "towers"),
+                                                        fairness.next_round(user_id))
+        if balance is None:
+            await message.answer("Insufficient balance.")
+            return
 
-    config = DIFFICULTIES[difficulty]
-    
-    towers_board = []
-    for row_idx in range(5):
-        row = [True] * config["bombs"] + [False] * (config["columns"] - config["bombs"])
-        random.shuffle(row)
-        towers_board.extend(row)
-
-    game_state = {
-        "user_id": user_id,
-        "bet": bet,
-        "difficulty": difficulty,
-        "board": towers_board,
-        "floor": 4,
-        "multiplier": 1.0,
-        "columns": config["columns"],
-        "multiplier_per_floor": config["multiplier_per_floor"],
-        "game_over": False
-    }
-    
-    keyboard = create_towers_keyboard(game_state)
-    game_msg = await message.answer(
-        f"🗼 Towers Game Started!\nDifficulty: {difficulty.upper()}\nBet: ⭐{bet}\nWinnings: ⭐{bet}\n\nClick tiles to reveal. Hit a bomb = lose!",
-        reply_markup=keyboard
-    )
-    
-    game_key = f"{user_id}_{game_msg.message_id}"
-    active_games[game_key] = game_state
+        game_state = TowersSession(bet, difficulty, generate_board(difficulty, floats))
+        
+        keyboard = create_towers_keyboard(game_state)
+        game_msg = await message.answer(
+            f"🗼 Towers Game Started!\nDifficulty: {difficulty.upper()}\nBet: {stars(bet)}\nWinnings: {stars(bet)}\n\nClick tiles to reveal. Hit a bomb = lose!\n🎲 Nonce: {nonce}",
+            reply_markup=keyboard
+        )
+        
+        sessions.put(user_id, game_msg.message_id, game_state)
 
 
 
 async def towers_callback(callback_query: CallbackQuery) -> None:
     user_id = callback_query.from_user.id
     msg_id = callback_query.message.message_id
-    game_key = f"{user_id}_{msg_id}"
+    game_state = sessions.get(user_id, msg_id)
     
-    if game_key not in active_games:
+    if not isinstance(game_state, TowersSession):
         await callback_query.answer("Game not found or expired.", show_alert=True)
         return
     
-    game_state = active_games[game_key]
     data = callback_query.data
     
     if data == "towers_noop":
@@ -94,23 +177,28 @@ async def towers_callback(callback_query: CallbackQuery) -> None:
     
     if action == "newgame":
         await callback_query.answer()
-        del active_games[game_key]
-        await start_new_towers_game(callback_query.message, game_state["bet"], game_state["difficulty"], user_id)
+        sessions.pop(user_id, msg_id)
+        await start_new_towers_game(callback_query.message, game_state.bet, game_state.difficulty, user_id)
         return
     
-    if game_state["game_over"]:
+    if game_state.game_over:
         await callback_query.answer("Game over! Start a new game.", show_alert=True)
         return
     
     if action == "cashout":        
-        winnings = int(game_state["bet"] * game_state["multiplier"])
-        increment_balance(user_id, winnings)
+        winnings = game_state.winnings
+        # Ended before the credit is awaited, so a second cashout cannot pay twice.
+        game_state.game_over = True
+        try:
+            balance = await settle(user_id, winnings, "towers")
+        except Exception:
+            game_state.game_over = False
+            raise
         
-        text = f"💰 Cashed out!\nWinnings: ⭐{winnings}\nBalance: ⭐{get_user_balance(user_id)[0]}"
-        game_state["game_over"] = True
+        text = f"💰 Cashed out!\nWinnings: {stars(winnings)}\nBalance: {stars(balance)}"
         keyboard = create_towers_keyboard(game_state)
         await callback_query.message.edit_text(text, reply_markup=keyboard)
-        await callback_query.answer(f"Won ⭐{winnings}!")
+        await callback_query.answer(f"Won {stars(winnings)}!")
         return
     
     try:
@@ -119,84 +207,75 @@ async def towers_callback(callback_query: CallbackQuery) -> None:
         await callback_query.answer()
         return
     
-    if game_state["game_over"]:
+    if game_state.game_over:
         await callback_query.answer()
         return
     
     
-    columns = game_state["columns"]
+    columns = game_state.columns
     row_idx = tile // columns
     
-    if row_idx != game_state["floor"]:
-        await callback_query.answer("You can only reveal the current floor!", show_alert=True)
+    if not 0 <= tile < FLOORS * columns:
+        await callback_query.answer()
         return
     
-    hit_bomb = game_state["board"][tile]
+    if row_idx != game_state.floor:
+        await callback_query.answer("You can only reveal the current floor!", show_alert=True)
+        return
     
-    if hit_bomb:
-        game_state["game_over"] = True
-        
-        text = f"💣 BOOM! You hit a bomb!\nLost: ⭐{game_state['bet']}\nBalance: ⭐{get_user_balance(user_id)[0]}"
+    if not game_state.climb(tile):
+        text = f"💣 BOOM! You hit a bomb!\nLost: {stars(game_state.bet)}\nBalance: {stars((await get_user_balance(user_id))[0])}"
         
         keyboard = create_towers_keyboard(game_state)
         await callback_query.message.edit_text(text, reply_markup=keyboard)
         await callback_query.answer("You hit a bomb!")
     else:
-        game_state["multiplier"] *= game_state["multiplier_per_floor"]
-        winnings = int(game_state["bet"] * game_state["multiplier"])
+        winnings = game_state.winnings
 
-        text = f"🗼 Towers Game\nDifficulty: {game_state['difficulty'].upper()}\nBet: ⭐{game_state['bet']}\nMultiplier: {game_state['multiplier']:.1f}x\nWinnings: ⭐{winnings}\n\nClick tiles to reveal. Hit a bomb = lose!"
-        game_state["floor"] -= 1
+        text = f"🗼 Towers Game\nDifficulty: {game_state.difficulty.upper()}\nBet: {stars(game_state.bet)}\nMultiplier: {game_state.multiplier:.1f}x\nWinnings: {stars(winnings)}\n\nClick tiles to reveal. Hit a bomb = lose!"
         keyboard = create_towers_keyboard(game_state)
         await callback_query.message.edit_text(text, reply_markup=keyboard)
-        await callback_query.answer(f"Safe! Multiplier: {game_state['multiplier']:.1f}x")
-
-
-def create_towers_keyboard(game_state: dict) -> InlineKeyboardMarkup:
-    keyboard = []
-    board = game_state["board"]
-    game_over = game_state["game_over"]
-    columns = game_state["columns"]
-    floor = game_state["floor"]
-    num_tiles = len(board)
-    rows = num_tiles // columns
-    
-    for row in range(rows):
-        row_buttons = []
-        for col in range(columns):
-            tile_idx = row * columns + col
-            
-            if floor < row or game_over:
-                if board[tile_idx]:
-                    button_text = "💣"
-                else:
-                    button_text = "✅"
-            else:
-                button_text = "⬜"
-            
-            if not game_over:
-                row_buttons.append(
-                    InlineKeyboardButton(text=button_text, callback_data=f"towers_{tile_idx}")
-                )
-            else:
-                row_buttons.append(
-                    InlineKeyboardButton(text=button_text, callback_data="towers_noop")
-                )
-        
-        keyboard.append(row_buttons)
-    
-    action_row = []
-    
-    if game_state["game_over"]:
-        action_row.append(
-            InlineKeyboardButton(text="🔄 New Game", callback_data="towers_newgame")
-        )
+        await callback_query.answer(f"Safe! Multiplier: {game_state.multiplier:.1f}x")
+
+
+@lru_cache(maxsize=None)
+def _button(text: str, callback_data: str) -> InlineKeyboardButton:
+    return InlineKeyboardButton(text=text, callback_data=callback_data)
+
+
+@lru_cache(maxsize=None)
+def _row(columns: int, row: int, pattern: int, revealed: bool, game_over: bool) -> tuple:
+    row_buttons = []
+    for col in range(columns):
+        tile_idx = row * columns + col
+        if revealed:
+            button_text = "💣" if pattern >> col & 1 else "✅"
+        else:
+            button_text = "⬜"
+        row_buttons.append(_button(button_text, "towers_noop" if game_over else f"towers_{tile_idx}"))
+    return tuple(row_buttons)
+
+
+@lru_cache(maxsize=KEYBOARD_CACHE_SIZE)
+def _keyboard(columns: int, visible: int, floor: int, game_over: bool) -> InlineKeyboardMarkup:
+    row_mask = (1 << columns) - 1
+    keyboard = [
+        _row(columns, row, visible >> (row * columns) & row_mask, floor < row, game_over)
+        for row in range(FLOORS)
+    ]
+    if game_over:
+        keyboard.append((_button("🔄 New Game", "towers_newgame"),))
     else:
-        action_row.append(
-            InlineKeyboardButton(text="💰 Cash Out", callback_data="towers_cashout")
-        )    
-    
-        
-    keyboard.append(action_row)
-    
+        keyboard.append((_button("💰 Cash Out", "towers_cashout"),))
     return InlineKeyboardMarkup(inline_keyboard=keyboard)
+
+
+def create_towers_keyboard(game_state: TowersSession) -> InlineKeyboardMarkup:
+    columns = game_state.columns
+    if game_state.game_over:
+        return _keyboard(columns, game_state.board, -1, True)
+    # Only floors above the current one are uncovered, so mask the rest out
+    # of the cache key.
+    floor = game_state.floor
+    visible = game_state.board & ~((1 << ((floor + 1) * columns)) - 1)
+    return _keyboard(columns, visible, floor, False)
@@ -1,9 +1,31 @@
-from aiogram.types import Message, PreCheckoutQuery, SuccessfulPayment
+import asyncio
+import re
+from aiogram.types import Message, PreCheckoutQuery, SuccessfulPayment, BufferedInputFile
 from aiogram.filters import CommandStart, Command, Filter
-from database import add_user, get_user_balance, get_leaderboard, update_balance, increment_balance
-from database import cursor
+from database import (
+    add_user,
+    get_user_balance,
+    get_leaderboard,
+    get_user_rank,
+    update_balance,
+    increment_balance,
+    reconcile_ledger,
+    get_ledger,
+    get_stats
+)
+from broadcast import start_broadcast
+from sefaria import random_texts
+from games.sessions import sessions
+from profiler import profiler, collapsed, top_frames, PROFILE_MAX_SECONDS
+from fairness import fairness, commitment, round_floats
+from games import mines, towers, roulette
+from money import MINOR_UNITS, parse_amount, stars
 from os import getenv
-import requests
+import aiohttp
+import time
+
+# Seeds are shown inside Markdown code spans, which cannot escape a backtick.
+CLIENT_SEED = re.compile(r"[A-Za-z0-9_-]{1,64}")
 
 class IsAdmin(Filter):
     async def __call__(self, message: Message) -> bool:
@@ -13,13 +35,13 @@ class IsAdmin(Filter):
 
 
 async def command_start_handler(message: Message) -> None:
-    add_user(message.from_user.id, message.from_user.username, message.from_user.full_name)
-    balance = get_user_balance(message.from_user.id)
+    await add_user(message.from_user.id, message.from_user.username, message.from_user.full_name)
+    balance = await get_user_balance(message.from_user.id)
     
     welcome_text = f"""
 🎰 **Welcome to Israel.game, {message.from_user.full_name}!** 🎰
 
-Your current balance: **⭐{balance[0]}**
+Your current balance: **{stars(balance[0])}**
 
 Get started by playing games or depositing more funds!
 
@@ -43,19 +65,24 @@ async def help_command(message: Message) -> None:
 /balance - Check your current balance
 /deposit <amount> - Deposit Telegram Stars to your balance
 /withdraw <amount> - Withdraw Stars from your balance
-/leaderboard - View top 10 players
+/leaderboard [page] - View top players and your rank
+/stats - Your games, wagers, wins and RTP per game
+/fair - Seeds behind your games, /fair rotate to reveal them
+/verify <game> <server\_seed> <client\_seed> <nonce> - Replay a game
 
 *Games:*
 /towers <bet> [difficulty] - Play Towers game
   Difficulties: easy (3 cols, 1 bomb), medium (2 cols, 1 bomb), hard (3 cols, 2 bombs)
   Example: /towers 100 easy
+  Autoplay: /towers 100 hard auto 4 x10 plays 10 games to floor 4
 
 /mines <bet> [grid\_size] - Play Mines game
   Grid sizes: 5, 10, 15 (default: 10)
   Example: /mines 100 10
+  Autoplay: /mines 100 5 auto 8 x10 plays 10 games of 8 picks
 
-/roulette <bet> - Play Roulette game
-  Example: /roulette 100
+/roulette <bet> <color> [xN] - Play Roulette game
+  Example: /roulette 100 red, or /roulette 100 red x50 for 50 spins at once
 
 *Game Mechanics:*
 🗼 Towers: Open tiles from bottom to top. Complete each row to unlock the next.
@@ -67,18 +94,46 @@ Good luck! 🍀
     await message.answer(help_text, parse_mode="Markdown")
 
 async def random_text_command(message: Message) -> None:
-    response = requests.get("https://www.sefaria.org/api/texts/random?categories=Mishnah").json()
+    try:
+        text, ref = await random_texts.get()
+    except (aiohttp.ClientError, asyncio.TimeoutError, KeyError):
+        await message.answer("Couldn't fetch a text right now, try again later.")
+        return
     
-    await message.answer(f"<blockquote>{response['text']}</blockquote>\n{response['ref']}", parse_mode="html")
+    await message.answer(f"<blockquote>{text}</blockquote>\n{ref}", parse_mode="html")
 
 async def balance_command(message: Message) -> None:
-    result = get_user_balance(message.from_user.id)
+    result = await get_user_balance(message.from_user.id)
     if result:
-        await message.answer(f"Your balance: ⭐{result[0]}")
+        await message.answer(f"Your balance: {stars(result[0])}")
     else:
         await message.answer("Balance not found.")
 
 
+def _stats_text(rows) -> str:
+    lines = []
+    totals = [0, 0, 0]
+    for game, games, wagered, won, biggest in rows:
+        rtp = f"{won / wagered:.1%}" if wagered else "-"
+        lines.append(f"{game.capitalize()}: {games} games, wagered {stars(wagered)}, won {stars(won)}, "
+                     f"RTP {rtp}, best {stars(biggest)}")
+        totals[0] += games
+        totals[1] += wagered
+        totals[2] += won
+    games, wagered, won = totals
+    lines.append(f"\nTotal: {games} games, wagered {stars(wagered)}, won {stars(won)}, "
+                 f"net {stars(won - wagered, signed=True)}")
+    return "\n".join(lines)
+
+
+async def stats_command(message: Message) -> None:
+    rows = await get_stats(message.from_user.id)
+    if not rows:
+        await message.answer("No games played yet.")
+        return
+    await message.answer(f"📊 Your stats\n\n{_stats_text(rows)}")
+
+
 async def deposit_command(message: Message) -> None:
     args = message.text.split()
     if len(args) != 2:
@@ -118,22 +173,115 @@ async def successful_payment_handler(message: Message) -> None:
         user_id = int(user_id_str)
         amount = int(amount_str)
         
-        increment_balance(user_id, amount)
+        await increment_balance(user_id, amount * MINOR_UNITS, "deposit", payment.telegram_payment_charge_id)
         
-        await message.answer(f"✅ Deposit successful! Added ⭐{amount} to your balance.")
+        await message.answer(f"✅ Deposit successful! Added {stars(amount * MINOR_UNITS)} to your balance.")
 
 async def withdraw_command(message: Message) -> None:
     await message.answer("Coming soon.")
 
+LEADERBOARD_PAGE_SIZE = 10
+
+
 async def leaderboard_command(message: Message) -> None:
-    rows = get_leaderboard(10)
+    args = message.text.split()
+    
+    try:
+        page = int(args[1]) if len(args) > 1 else 1
+        if page < 1:
+            raise ValueError
+    except ValueError:
+        await message.answer("Usage: /leaderboard [page]\nExample: /leaderboard 2")
+        return
+    
+    offset = (page - 1) * LEADERBOARD_PAGE_SIZE
+    rows = await get_leaderboard(LEADERBOARD_PAGE_SIZE, offset)
     if rows:
-        text = "Leaderboard:\n" + "\n".join(f"{row[0]}: ⭐{row[1]}" for row in rows)
+        text = f"Leaderboard (page {page}):\n" + "\n".join(
+            f"{offset + i}. {row[0]}: {stars(row[1])}" for i, row in enumerate(rows, 1)
+        )
+        rank = await get_user_rank(message.from_user.id)
+        if rank:
+            text += f"\n\nYour rank: #{rank[0]} of {rank[1]}"
         await message.answer(text)
     else:
         await message.answer("No users found.")
 
 
+async def fair_command(message: Message) -> None:
+    args = message.text.split()
+    user_id = message.from_user.id
+
+    if len(args) > 1 and args[1].lower() == "rotate":
+        client_seed = args[2] if len(args) > 2 else None
+        if client_seed is not None and not CLIENT_SEED.fullmatch(client_seed):
+            await message.answer("Client seed must be 1-64 letters, digits, _ or -.")
+            return
+        async with fairness.dealing(user_id):
+            if sessions.live(user_id):
+                await message.answer("Finish or cash out your Mines and Towers games before rotating seeds.")
+                return
+            server_seed, old_client_seed, nonces = await fairness.rotate(user_id, client_seed)
+        state = await fairness.state(user_id)
+        await message.answer(
+            f"🔓 Revealed server seed: `{server_seed}`\n"
+            f"Client seed: `{old_client_seed}`\nGames played: {nonces}\n\n"
+            f"🔐 New server seed hash: `{state.commitment}`\nNew client seed: `{state.client_seed}`",
+            parse_mode="Markdown"
+        )
+        return
+
+    state = await fairness.state(user_id)
+    await message.answer(
+        f"🔐 Server seed hash: `{state.commitment}`\n"
+        f"Client seed: `{state.client_seed}`\nNext nonce: {state.nonce}\n\n"
+        "Every board is HMAC-SHA256(server seed, client seed:nonce:block). "
+        "/fair rotate [client\\_seed] reveals the server seed so you can /verify past games.",
+        parse_mode="Markdown"
+    )
+
+
+def _verify_result(game: str, floats, option: str) -> str:
+    if game == "mines":
+        count = int(option or 3)
+        if not 1 <= count <= 24:
+            raise ValueError
+        board = mines.generate_board(count, floats)
+        return "\n".join(
+            "".join("💣" if board >> (row * 5 + col) & 1 else "💎" for col in range(5)) for row in range(5)
+        )
+    if game == "towers":
+        difficulty = (option or "easy").lower()
+        columns = towers.DIFFICULTIES[difficulty]["columns"]
+        board = towers.generate_board(difficulty, floats)
+        return "\n".join(
+            "".join("💣" if board >> (row * columns + col) & 1 else "🟩" for col in range(columns))
+            for row in range(towers.FLOORS)
+        )
+    if game == "roulette":
+        reel = roulette.spin_reel(floats)
+        return f"{''.join(reel[15:24])}\n➖➖➖➖🔺➖➖➖➖\nResult: {reel[19]}"
+    raise ValueError
+
+
+async def verify_command(message: Message) -> None:
+    args = message.text.split()
+    usage = ("Usage: /verify <game> <server_seed> <client_seed> <nonce> [mines|difficulty]\n"
+             "Example: /verify mines 3f9c... a1b2c3 7 5")
+
+    try:
+        game, server_seed, client_seed, nonce = args[1].lower(), args[2], args[3], int(args[4])
+        option = args[5] if len(args) > 5 else None
+        result = _verify_result(game, round_floats(server_seed, client_seed, nonce), option)
+    except (IndexError, ValueError, KeyError):
+        await message.answer(usage)
+        return
+
+    await message.answer(
+        f"🔍 {game.capitalize()}, nonce {nonce}\nServer seed hash: {commitment(server_seed)}\n\n{result}"
+    )
+
+
 async def admin_setbalance_command(message: Message) -> None:
     args = message.text.split()
     
@@ -143,13 +291,13 @@ async def admin_setbalance_command(message: Message) -> None:
     
     try:
         user_id = int(args[1])
-        balance = float(args[2])
+        balance = parse_amount(args[2])
         
         if user_id == -1:
             user_id = message.from_user.id
         
-        update_balance(user_id, balance)
-        await message.answer(f"✅ Set balance for user {user_id} to ⭐{balance}")
+        await update_balance(user_id, balance, f"set by {message.from_user.id}")
+        await message.answer(f"✅ Set balance for user {user_id} to {stars(balance)}")
     except ValueError:
         await message.answer("❌ Invalid user_id or balance. Please provide valid numbers.")
 
@@ -164,23 +312,84 @@ async def admin_broadcast_command(message: Message) -> None:
     broadcast_message = args[1]
     
     try:
-        cursor.execute("SELECT id FROM users")
-        users = cursor.fetchall()
-        
-        if not users:
+        job = await start_broadcast(message.bot, broadcast_message, message.chat.id)
+        if job is None:
             await message.answer("❌ No users found to broadcast to.")
-            return
-        
-        bot = message.bot
-        
-        success_count = 0
-        for user in users:
-            try:
-                await bot.send_message(user[0], f"📢 {broadcast_message}")
-                success_count += 1
-            except Exception:
-                pass
-        
-        await message.answer(f"✅ Broadcast sent to {success_count}/{len(users)} users")
     except Exception as e:
-        await message.answer(f"❌ Error during broadcast: {str(e)}")
\ No newline at end of file
+        await message.answer(f"❌ Error during broadcast: {str(e)}")
+
+
+async def admin_sessions_command(message: Message) -> None:
+    metrics = sessions.metrics()
+    await message.answer(
+        f"🎮 Active game sessions: {metrics['sessions']}\n"
+        f"Players: {metrics['users']}\n"
+        f"Evicted: {metrics['evicted']}\n"
+        f"Memory: ~{metrics['approx_bytes'] / 1024:.1f} KiB"
+    )
+
+
+async def admin_profile_command(message: Message) -> None:
+    args = message.text.split()
+
+    try:
+        seconds = float(args[1]) if len(args) > 1 else 10.0
+    except ValueError:
+        seconds = 0.0
+    if not 0 < seconds <= PROFILE_MAX_SECONDS:
+        await message.answer(f"Usage: /admin_profile [seconds], up to {PROFILE_MAX_SECONDS:g}")
+        return
+
+    if profiler.running:
+        await message.answer("❌ A profile is already running.")
+        return
+
+    await message.answer(f"🔬 Profiling for {seconds:g}s...")
+    counts = await profiler.profile(seconds)
+    frames, busy = top_frames(counts)
+    top = "\n".join(f"{share:6.1%}  {frame}" for frame, share in frames)
+    caption = f"🔬 {profiler.samples} samples over {seconds:g}s, threads busy {busy:.1%}\n\nTop frames:\n{top}"
+    document = BufferedInputFile(collapsed(counts).encode(), filename=f"profile-{int(time.time())}.folded")
+    await message.answer_document(document, caption=caption[:1024])
+
+
+async def admin_audit_command(message: Message) -> None:
+    await message.answer("🔎 Reconciling balances with the ledger...")
+    result = await reconcile_ledger()
+    base = f"snapshot #{result['snapshot']}" if result['snapshot'] else "no snapshot"
+    text = f"Checked {result['checked']} balances against {base} + {result['tail']} ledger rows.\n"
+    mismatches = result["mismatches"]
+    if not mismatches:
+        await message.answer(text + "✅ Every balance matches the ledger.")
+        return
+    lines = "\n".join(f"{user_id}: balance {stars(balance)}, ledger {stars(expected)}" for user_id, balance, expected in mismatches[:20])
+    await message.answer(text + f"❌ {len(mismatches)} mismatches:\n{lines}")
+
+
+async def admin_stats_command(message: Message) -> None:
+    rows = await get_stats(0)
+    if not rows:
+        await message.answer("No games played yet.")
+        return
+    await message.answer(f"📊 All players\n\n{_stats_text(rows)}")
+
+
+async def admin_ledger_command(message: Message) -> None:
+    args = message.text.split()
+
+    try:
+        user_id = int(args[1])
+    except (IndexError, ValueError):
+        await message.answer("Usage: /admin_ledger <user_id>")
+        return
+
+    rows = await get_ledger(user_id)
+    if not rows:
+        await message.answer("No ledger entries found.")
+        return
+    lines = "\n".join(
+        f"{time.strftime('%Y-%m-%d %H:%M', time.gmtime(created_at))} {kind} {stars(amount, signed=True)} → {stars(balance)}"
+        + (f" ({ref})" if ref else "")
+        for kind, amount, balance, ref, created_at in rows
+    )
+    await message.answer(f"📒 Last {len(rows)} entries for {user_id}:\n{lines}")
@@ -0,0 +1,25 @@
+from os import getenv
+
+import aiohttp
+
+HTTP_TIMEOUT = float(getenv("HTTP_TIMEOUT", "10"))
+HTTP_POOL_SIZE = int(getenv("HTTP_POOL_SIZE", "20"))
+
+_session = None
+
+
+def get_session() -> aiohttp.ClientSession:
+    global _session
+    if _session is None or _session.closed:
+        _session = aiohttp.ClientSession(
+            connector=aiohttp.TCPConnector(limit=HTTP_POOL_SIZE, ttl_dns_cache=300),
+            timeout=aiohttp.ClientTimeout(total=HTTP_TIMEOUT)
+        )
+    return _session
+
+
+async def close_session() -> None:
+    global _session
+    if _session is not None and not _session.closed:
+        await _session.close()
+    _session = None
@@ -0,0 +1,94 @@
+import threading
+from array import array
+from bisect import bisect_left, bisect_right, insort
+
+
+class Leaderboard:
+    def __init__(self, size: int = 100):
+        self.size = size
+        self._lock = threading.Lock()
+        # Every user's balance in ascending order, used for rank lookups.
+        self._balances = array("q")
+        # (-balance, user_id) for the best players. Always a prefix of the
+        # real ranking, but may shrink below `size` when a member drops out.
+        self._top = []
+        self._names = {}
+        self.loaded = False
+
+    def load(self, balances, top_rows) -> None:
+        with self._lock:
+            self._balances = array("q", sorted(balances))
+            self._fill(top_rows)
+            self.loaded = True
+
+    def refill(self, top_rows) -> None:
+        with self._lock:
+            self._fill(top_rows)
+
+    def invalidate(self) -> None:
+        with self._lock:
+            self.loaded = False
+
+    def _fill(self, top_rows) -> None:
+        self._top = sorted((-balance, user_id) for user_id, _, balance in top_rows)
+        self._names = {user_id: name for user_id, name, _ in top_rows}
+
+    @property
+    def needs_refill(self) -> bool:
+        return len(self._top) < min(self.size, len(self._balances))
+
+    def add(self, user_id: int, name: str, balance: int) -> None:
+        with self._lock:
+            if not self.loaded:
+                return
+            if self._top and -self._top[-1][0] < balance:
+                self._insert(user_id, name, balance)
+            elif len(self._top) == len(self._balances):
+                self._insert(user_id, name, balance)
+            insort(self._balances, balance)
+
+    def update(self, user_id: int, old: int, new: int, name_lookup) -> None:
+        with self._lock:
+            if not self.loaded:
+                return
+            i = bisect_left(self._balances, old)
+            if i == len(self._balances) or self._balances[i] != old:
+                # Another process changed this balance since the last load.
+                self.loaded = False
+                return
+            del self._balances[i]
+            insort(self._balances, new)
+
+            if not self._top:
+                return
+            floor = -self._top[-1][0]
+            everyone_listed = len(self._top) == len(self._balances)
+            if user_id in self._names:
+                name = self._names.pop(user_id)
+                del self._top[bisect_left(self._top, (-old, user_id))]
+                if new >= floor or everyone_listed:
+                    self._insert(user_id, name, new)
+            elif new > floor:
+                self._insert(user_id, name_lookup(user_id), new)
+
+    def _insert(self, user_id: int, name: str, balance: int) -> None:
+        insort(self._top, (-balance, user_id))
+        self._names[user_id] = name
+        if len(self._top) > self.size:
+            _, dropped = self._top.pop()
+            del self._names[dropped]
+
+    def page(self, offset: int, limit: int):
+        with self._lock:
+            end = offset + limit
+            if end > len(self._top) and len(self._top) < len(self._balances):
+                return None
+            return [(self._names[user_id], -neg_balance) for neg_balance, user_id in self._top[offset:end]]
+
+    def rank(self, balance: int) -> int:
+        with self._lock:
+            return len(self._balances) - bisect_right(self._balances, balance) + 1
+
+    @property
+    def total(self) -> int:
+        return len(self._balances)
@@ -0,0 +1,40 @@
+import asyncio
+import logging
+from os import getenv
+
+from database import take_snapshot
+
+LEDGER_SNAPSHOT_INTERVAL = float(getenv("LEDGER_SNAPSHOT_INTERVAL", "3600"))
+
+logger = logging.getLogger(__name__)
+
+
+class SnapshotScheduler:
+    def __init__(self, interval: float):
+        self.interval = interval
+        self._task = None
+
+    async def _run(self) -> None:
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                snapshot_id = await take_snapshot()
+                logger.info("Balance snapshot #%s taken", snapshot_id)
+            except Exception:
+                logger.exception("Balance snapshot failed")
+
+    def start(self) -> None:
+        if self._task is None and self.interval > 0:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+
+snapshots = SnapshotScheduler(LEDGER_SNAPSHOT_INTERVAL)
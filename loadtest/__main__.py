@@ -0,0 +1,54 @@
+import argparse
+import asyncio
+import logging
+import os
+import tempfile
+
+
+async def _run(args) -> None:
+    import database
+    import main as bot_main
+    from loadtest.fake_api import FakeBotAPI, create_bot
+    from loadtest.players import run_players, seed_users
+
+    api = FakeBotAPI(latency=args.api_latency)
+    bot = create_bot(await api.start())
+    await bot_main.dp.emit_startup(bot=bot)
+    try:
+        if args.seed_users:
+            await asyncio.to_thread(seed_users, database.DB_PATH, args.seed_users)
+            database.leaderboard.invalidate()
+            print(f"Seeded {args.seed_users} users into {database.DB_PATH}")
+        stats = await run_players(bot, bot_main.dp, api.telegram, args.players, args.actions, args.bet, args.think)
+        print(stats.report())
+        await asyncio.sleep(args.drain)
+        print(f"\nBot API calls: {dict(api.telegram.calls)}")
+    finally:
+        await bot_main.dp.emit_shutdown(bot=bot)
+        await bot.session.close()
+        await api.stop()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="End-to-end load test of the dispatcher against a fake Bot API.")
+    parser.add_argument("--players", type=int, default=1000, help="concurrent virtual players")
+    parser.add_argument("--actions", type=int, default=10, help="games or commands per player")
+    parser.add_argument("--bet", type=int, default=10)
+    parser.add_argument("--think", type=float, default=0.05, help="mean pause between a player's actions, seconds")
+    parser.add_argument("--api-latency", type=float, default=0.0, help="seconds the fake Bot API takes per call")
+    parser.add_argument("--seed-users", type=int, default=0, help="extra users inserted to make casino.db big")
+    parser.add_argument("--db", default=None, help="database file, a fresh temporary one by default")
+    parser.add_argument("--drain", type=float, default=5.0, help="seconds to let background animations finish")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.WARNING)
+    # The bot modules read their settings at import time.
+    os.environ["CASINO_DB"] = args.db or os.path.join(tempfile.mkdtemp(), "loadtest.db")
+    os.environ.setdefault("RANDOM_TEXT_POOL_SIZE", "0")
+    # The fake API has no flood limits, pacing would only measure the governor.
+    os.environ.setdefault("OUTBOUND_GLOBAL_RATE", "0")
+    asyncio.run(_run(args))
+
+
+if __name__ == "__main__":
+    main()
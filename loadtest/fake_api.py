@@ -0,0 +1,101 @@
+import asyncio
+import itertools
+import json
+import time
+from collections import Counter, deque
+
+from aiohttp import web
+
+MESSAGE_METHODS = {"sendMessage", "editMessageText", "sendInvoice", "sendDocument"}
+GAME_PREFIXES = ("mines_", "towers_")
+
+
+class FakeTelegram:
+    def __init__(self, history: int = 1000):
+        self.calls = Counter()
+        self.history = deque(maxlen=history)
+        # chat_id -> message_id of the last message carrying a game keyboard.
+        self.game_messages = {}
+        self._message_ids = itertools.count(1_000_000)
+
+    def result(self, method: str, params: dict):
+        self.calls[method] += 1
+        self.history.append((method, params))
+        if method not in MESSAGE_METHODS or params.get("inline_message_id"):
+            return True
+        chat_id = int(params.get("chat_id", 0))
+        message_id = int(params.get("message_id") or next(self._message_ids))
+        if method == "sendMessage" and any(prefix in params.get("reply_markup", "") for prefix in GAME_PREFIXES):
+            self.game_messages[chat_id] = message_id
+        return {
+            "message_id": message_id,
+            "date": int(time.time()),
+            "chat": {"id": chat_id, "type": "private" if chat_id > 0 else "group"},
+            "text": params.get("text") or params.get("title") or ""
+        }
+
+
+class FakeBotAPI:
+    def __init__(self, telegram: FakeTelegram = None, latency: float = 0.0, host: str = "127.0.0.1", port: int = 0):
+        self.telegram = telegram or FakeTelegram()
+        self.latency = latency
+        self.host = host
+        self.port = port
+        self._runner = None
+
+    async def _handle(self, request: web.Request) -> web.Response:
+        if request.content_type == "application/json":
+            params = await request.json()
+        else:
+            params = dict(await request.post())
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        result = self.telegram.result(request.match_info["method"], params)
+        return web.json_response({"ok": True, "result": result})
+
+    async def start(self) -> str:
+        app = web.Application(client_max_size=64 * 1024 * 1024)
+        app.router.add_post("/bot{token}/{method}", self._handle)
+        self._runner = web.AppRunner(app, access_log=None)
+        await self._runner.setup()
+        await web.TCPSite(self._runner, self.host, self.port).start()
+        self.port = self._runner.addresses[0][1]
+        return self.url
+
+    @property
+    def url(self) -> str:
+        return f"http://{self.host}:{self.port}"
+
+    async def stop(self) -> None:
+        if self._runner is not None:
+            await self._runner.cleanup()
+
+
+def create_bot(api_url: str):
+    from aiogram import Bot
+    from aiogram.client.session.aiohttp import AiohttpSession
+    from aiogram.client.telegram import TelegramAPIServer
+
+    session = AiohttpSession(api=TelegramAPIServer.from_base(api_url))
+    return Bot(token="123456:loadtest", session=session)
+
+
+async def _serve(port: int, latency: float) -> None:
+    api = FakeBotAPI(latency=latency, port=port)
+    print(f"Fake Bot API listening on {await api.start()}")
+    try:
+        while True:
+            await asyncio.sleep(10)
+            print(json.dumps(dict(api.telegram.calls)))
+    finally:
+        await api.stop()
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Stand-in for the Telegram Bot API that records every call.")
+    parser.add_argument("--port", type=int, default=8081)
+    parser.add_argument("--latency", type=float, default=0.0, help="seconds added to every response")
+    args = parser.parse_args()
+    asyncio.run(_serve(args.port, args.latency))
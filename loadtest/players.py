@@ -0,0 +1,104 @@
+import asyncio
+import logging
+import random
+import sqlite3
+import time
+
+from aiogram import Bot, Dispatcher
+from aiogram.types import Update
+
+from loadtest import updates
+from loadtest.fake_api import FakeTelegram
+from loadtest.stats import LatencyStats
+
+logger = logging.getLogger(__name__)
+
+ACTIONS = [("roulette", 3), ("mines", 3), ("towers", 2), ("balance", 1), ("leaderboard", 1)]
+COLORS = ["red", "black", "yellow"]
+
+
+def seed_users(db_path: str, count: int, first_id: int = 10_000_000) -> None:
+    conn = sqlite3.connect(db_path)
+    try:
+        users = [(first_id + i, f"seed{i}", f"Seed {i}", random.randint(0, 1_000_000)) for i in range(count)]
+        conn.executemany("INSERT OR IGNORE INTO users (id, username, name, balance) VALUES (?, ?, ?, ?)", users)
+        # Keep the ledger in step so /admin_audit still reconciles.
+        conn.executemany("INSERT INTO ledger (user_id, kind, amount, balance, created_at) VALUES (?, 'opening', ?, ?, ?)",
+                         ((user_id, balance, balance, int(time.time())) for user_id, _, _, balance in users))
+        conn.commit()
+    finally:
+        conn.close()
+
+
+class VirtualPlayer:
+    def __init__(self, user_id: int, bot: Bot, dp: Dispatcher, telegram: FakeTelegram, stats: LatencyStats,
+                 bet: int, think: float):
+        self.user_id = user_id
+        self.bot = bot
+        self.dp = dp
+        self.telegram = telegram
+        self.stats = stats
+        self.bet = bet
+        self.think = think
+
+    async def feed(self, payload: dict, label: str) -> None:
+        update = Update.model_validate(payload, context={"bot": self.bot})
+        start = time.perf_counter()
+        try:
+            await self.dp.feed_update(self.bot, update)
+        except Exception:
+            logger.exception("%s failed", label)
+            self.stats.error(label)
+        self.stats.record(label, time.perf_counter() - start)
+
+    async def command(self, text: str) -> None:
+        await self.feed(updates.command(self.user_id, text), text.split()[0])
+
+    async def click(self, message_id: int, data: str, label: str) -> None:
+        await self.feed(updates.callback(self.user_id, message_id, data), label)
+
+    async def play_mines(self) -> None:
+        await self.command(f"/mines {self.bet} {random.randint(1, 10)}")
+        message_id = self.telegram.game_messages.get(self.user_id)
+        if message_id is None:
+            return
+        for tile in random.sample(range(25), random.randint(1, 5)):
+            await self.click(message_id, f"mines_{tile}", "mines_tile")
+        await self.click(message_id, "mines_cashout", "mines_cashout")
+
+    async def play_towers(self) -> None:
+        difficulty = random.choice(["easy", "medium", "hard"])
+        await self.command(f"/towers {self.bet} {difficulty}")
+        message_id = self.telegram.game_messages.get(self.user_id)
+        if message_id is None:
+            return
+        columns = 2 if difficulty == "medium" else 3
+        for floor in range(4, 4 - random.randint(1, 4), -1):
+            await self.click(message_id, f"towers_{floor * columns + random.randrange(columns)}", "towers_tile")
+        await self.click(message_id, "towers_cashout", "towers_cashout")
+
+    async def run(self, actions: int) -> None:
+        await self.command("/start")
+        names = [name for name, _ in ACTIONS]
+        weights = [weight for _, weight in ACTIONS]
+        for _ in range(actions):
+            action = random.choices(names, weights)[0]
+            if action == "roulette":
+                await self.command(f"/roulette {self.bet} {random.choice(COLORS)}")
+            elif action == "mines":
+                await self.play_mines()
+            elif action == "towers":
+                await self.play_towers()
+            else:
+                await self.command(f"/{action}")
+            if self.think:
+                await asyncio.sleep(random.uniform(0, 2 * self.think))
+
+
+async def run_players(bot: Bot, dp: Dispatcher, telegram: FakeTelegram, players: int, actions: int,
+                      bet: int = 10, think: float = 0.05, first_id: int = 1) -> LatencyStats:
+    stats = LatencyStats()
+    await asyncio.gather(*(
+        VirtualPlayer(first_id + i, bot, dp, telegram, stats, bet, think).run(actions) for i in range(players)
+    ))
+    return stats
@@ -0,0 +1,42 @@
+import time
+from collections import Counter, defaultdict
+
+
+def percentile(values: list, q: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, round(q / 100 * len(ordered)) - 1))
+    return ordered[index]
+
+
+class LatencyStats:
+    def __init__(self):
+        self.latencies = defaultdict(list)
+        self.errors = Counter()
+        self.started = time.perf_counter()
+
+    def record(self, label: str, seconds: float) -> None:
+        self.latencies[label].append(seconds)
+
+    def error(self, label: str) -> None:
+        self.errors[label] += 1
+
+    def report(self) -> str:
+        elapsed = time.perf_counter() - self.started
+        total = sum(len(values) for values in self.latencies.values())
+        lines = [f"{'handler':<20} {'count':>8} {'p50 ms':>9} {'p99 ms':>9} {'max ms':>9} {'errors':>7}"]
+        for label in sorted(self.latencies):
+            values = self.latencies[label]
+            lines.append(
+                f"{label:<20} {len(values):>8} {percentile(values, 50) * 1000:>9.2f} "
+                f"{percentile(values, 99) * 1000:>9.2f} {max(values) * 1000:>9.2f} {self.errors[label]:>7}"
+            )
+        all_values = [value for values in self.latencies.values() for value in values]
+        lines.append(
+            f"{'all':<20} {total:>8} {percentile(all_values, 50) * 1000:>9.2f} "
+            f"{percentile(all_values, 99) * 1000:>9.2f} {max(all_values, default=0) * 1000:>9.2f} "
+            f"{sum(self.errors.values()):>7}"
+        )
+        lines.append(f"\n{total} updates in {elapsed:.2f}s -> {total / elapsed:,.0f} updates/s")
+        return "\n".join(lines)
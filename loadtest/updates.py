@@ -0,0 +1,42 @@
+import itertools
+import time
+
+_update_ids = itertools.count(1)
+_message_ids = itertools.count(1)
+
+
+def _user(user_id: int) -> dict:
+    return {"id": user_id, "is_bot": False, "first_name": f"Player{user_id}", "username": f"player{user_id}"}
+
+
+def _message(user_id: int, text: str, chat_id: int = None, message_id: int = None) -> dict:
+    chat_id = chat_id or user_id
+    message = {
+        "message_id": message_id or next(_message_ids),
+        "date": int(time.time()),
+        "chat": {"id": chat_id, "type": "private" if chat_id > 0 else "group"},
+        "from": _user(user_id),
+        "text": text
+    }
+    if text.startswith("/"):
+        command = text.split()[0]
+        message["entities"] = [{"type": "bot_command", "offset": 0, "length": len(command)}]
+    return message
+
+
+def command(user_id: int, text: str, chat_id: int = None) -> dict:
+    return {"update_id": next(_update_ids), "message": _message(user_id, text, chat_id)}
+
+
+def callback(user_id: int, message_id: int, data: str, chat_id: int = None) -> dict:
+    message = _message(user_id, "game", chat_id, message_id)
+    return {
+        "update_id": next(_update_ids),
+        "callback_query": {
+            "id": str(next(_update_ids)),
+            "from": _user(user_id),
+            "chat_instance": str(chat_id or user_id),
+            "message": message,
+            "data": data
+        }
+    }
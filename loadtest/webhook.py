@@ -0,0 +1,128 @@
+import argparse
+import asyncio
+import os
+import random
+import signal
+import socket
+import sys
+import tempfile
+import time
+
+from loadtest import updates
+from loadtest.stats import percentile
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+COMMANDS = ["/start", "/balance", "/leaderboard", "/mines 10 3", "/towers 10 easy", "/roulette 10 red", "/help"]
+
+
+def _free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def _synthetic_update(players: int) -> dict:
+    user_id = random.randint(1, players)
+    if random.random() < 0.3:
+        return updates.callback(user_id, random.randint(1, 1000), random.choice(["mines_cashout", "towers_cashout", "mines_3"]))
+    return updates.command(user_id, random.choice(COMMANDS))
+
+
+async def _run(args) -> None:
+    import aiohttp
+
+    import webhook
+    from loadtest.fake_api import FakeBotAPI, create_bot
+
+    api = FakeBotAPI()
+    api_url = await api.start()
+    server = process = None
+    if args.workers > 1:
+        # The sharded mode needs real processes, so run the bot as it is
+        # deployed and point it at the fake Bot API.
+        env = dict(os.environ, BOT_MODE="webhook", WORKERS=str(args.workers), BOT_API_URL=api_url,
+                   BOT_TOKEN="123456:loadtest", WEBHOOK_URL="")
+        process = await asyncio.create_subprocess_exec(sys.executable, "main.py", env=env, cwd=ROOT)
+    else:
+        import main as bot_main
+        server = asyncio.create_task(webhook.serve(bot_main.dp, create_bot(api_url)))
+    base = f"http://{webhook.WEBHOOK_HOST}:{webhook.WEBHOOK_PORT}"
+    headers = {"X-Telegram-Bot-Api-Secret-Token": webhook.WEBHOOK_SECRET}
+
+    async with aiohttp.ClientSession() as client:
+        deadline = time.monotonic() + args.start_timeout
+        while True:
+            try:
+                async with client.get(f"{base}/healthz") as response:
+                    if response.status == 200:
+                        print("health:", await response.json())
+                        break
+            except aiohttp.ClientConnectionError:
+                pass
+            if time.monotonic() > deadline:
+                raise SystemExit("webhook server did not come up")
+            await asyncio.sleep(0.2)
+
+        async with client.post(f"{base}{webhook.WEBHOOK_PATH}", json=updates.command(1, "/start"),
+                               headers={"X-Telegram-Bot-Api-Secret-Token": "wrong"}) as response:
+            print(f"wrong secret token -> {response.status}")
+        oversized = b"x" * (webhook.WEBHOOK_MAX_BODY + 1)
+        async with client.post(f"{base}{webhook.WEBHOOK_PATH}", data=oversized, headers=headers) as response:
+            print(f"oversized body -> {response.status}")
+
+        latencies = []
+        statuses = {}
+        semaphore = asyncio.Semaphore(args.concurrency)
+
+        async def post(update: dict) -> None:
+            async with semaphore:
+                start = time.perf_counter()
+                async with client.post(f"{base}{webhook.WEBHOOK_PATH}", json=update, headers=headers) as response:
+                    await response.read()
+                latencies.append(time.perf_counter() - start)
+                statuses[response.status] = statuses.get(response.status, 0) + 1
+
+        start = time.perf_counter()
+        await asyncio.gather(*(post(_synthetic_update(args.players)) for _ in range(args.updates)))
+        elapsed = time.perf_counter() - start
+
+    await asyncio.sleep(args.drain)
+    if process is not None:
+        process.send_signal(signal.SIGINT)
+        await process.wait()
+    else:
+        server.cancel()
+        try:
+            await server
+        except asyncio.CancelledError:
+            pass
+    await api.stop()
+
+    print(f"updates: {args.updates} in {elapsed:.2f}s ({args.updates / elapsed:,.0f}/s)")
+    print(f"statuses: {statuses}")
+    print(f"latency p50 {percentile(latencies, 50) * 1000:.2f} ms, p99 {percentile(latencies, 99) * 1000:.2f} ms")
+    print(f"bot api calls: {dict(api.telegram.calls)}")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Drive the webhook server with synthetic updates, no Telegram needed.")
+    parser.add_argument("--updates", type=int, default=2000)
+    parser.add_argument("--players", type=int, default=200)
+    parser.add_argument("--concurrency", type=int, default=50)
+    parser.add_argument("--workers", type=int, default=1, help="run the sharded mode with this many workers")
+    parser.add_argument("--start-timeout", type=float, default=120.0)
+    parser.add_argument("--drain", type=float, default=2.0, help="seconds to let background handlers finish")
+    args = parser.parse_args()
+
+    # The bot modules read their settings at import time.
+    os.environ.setdefault("CASINO_DB", os.path.join(tempfile.mkdtemp(), "harness.db"))
+    os.environ.setdefault("WEBHOOK_HOST", "127.0.0.1")
+    os.environ.setdefault("WEBHOOK_PORT", str(_free_port()))
+    os.environ.setdefault("WEBHOOK_SECRET", "harness-secret")
+    os.environ.setdefault("RANDOM_TEXT_POOL_SIZE", "0")
+    os.environ.setdefault("OUTBOUND_GLOBAL_RATE", "0")
+    asyncio.run(_run(args))
+
+
+if __name__ == "__main__":
+    main()
@@ -5,21 +5,40 @@ import sys
 from os import getenv
 from dotenv import load_dotenv
 
-from aiogram import Bot, Dispatcher
+# The modules below read their settings at import time.
+load_dotenv()
+
+from aiogram import Bot, Dispatcher, F
 from aiogram.client.default import DefaultBotProperties
+from aiogram.client.session.aiohttp import AiohttpSession
+from aiogram.client.telegram import TelegramAPIServer
 from aiogram.filters import CommandStart, Command
 
-from database import init_db
+from database import init_db, close_db
+from broadcast import resume_broadcasts
+from http_client import close_session
+import metrics
+from sefaria import random_texts
+from ledger import snapshots
+from fairness import fairness
 from handlers import (
     command_start_handler,
     help_command,
     random_text_command,
+    fair_command,
+    verify_command,
     balance_command,
     deposit_command,
     withdraw_command,
     leaderboard_command,
     admin_setbalance_command,
     admin_broadcast_command,
+    admin_sessions_command,
+    admin_profile_command,
+    admin_audit_command,
+    admin_ledger_command,
+    admin_stats_command,
+    stats_command,
     pre_checkout_handler,
     successful_payment_handler,
     IsAdmin
@@ -27,12 +46,21 @@ from handlers import (
 from games.roulette import roulette_command
 from games.mines import mines_command, mines_callback
 from games.towers import towers_command, towers_callback
-
-load_dotenv()
+from games.table import table_command, tables
+from games.antiflood import CallbackDebounceMiddleware
+from outbound import governor
+import sharding
+import webhook
 
 TOKEN = getenv("BOT_TOKEN")
+BOT_MODE = getenv("BOT_MODE", "polling")
+BOT_API_URL = getenv("BOT_API_URL")
 
 dp = Dispatcher()
+dp.message.middleware(metrics.HandlerTimingMiddleware())
+dp.callback_query.middleware(metrics.HandlerTimingMiddleware())
+dp.callback_query.outer_middleware(CallbackDebounceMiddleware())
+dp.pre_checkout_query.middleware(metrics.HandlerTimingMiddleware())
 
 dp.message.register(command_start_handler, CommandStart())
 dp.message.register(help_command, Command("help"))
@@ -41,11 +69,20 @@ dp.message.register(balance_command, Command("balance"))
 dp.message.register(deposit_command, Command("deposit"))
 dp.message.register(withdraw_command, Command("withdraw"))
 dp.message.register(leaderboard_command, Command("leaderboard"))
+dp.message.register(stats_command, Command("stats"))
+dp.message.register(fair_command, Command("fair"))
+dp.message.register(verify_command, Command("verify"))
+dp.message.register(table_command, Command("roulette"), F.chat.type.in_(sharding.GROUP_CHATS))
 dp.message.register(roulette_command, Command("roulette"))
 dp.message.register(mines_command, Command("mines"))
 dp.message.register(towers_command, Command("towers"))
 dp.message.register(admin_setbalance_command, Command("admin_setbalance"), IsAdmin())
 dp.message.register(admin_broadcast_command, Command("admin_broadcast"), IsAdmin())
+dp.message.register(admin_sessions_command, Command("admin_sessions"), IsAdmin())
+dp.message.register(admin_profile_command, Command("admin_profile"), IsAdmin())
+dp.message.register(admin_audit_command, Command("admin_audit"), IsAdmin())
+dp.message.register(admin_ledger_command, Command("admin_ledger"), IsAdmin())
+dp.message.register(admin_stats_command, Command("admin_stats"), IsAdmin())
 
 dp.pre_checkout_query.register(pre_checkout_handler)
 dp.message.register(successful_payment_handler, lambda message: message.content_type == "successful_payment")
@@ -54,12 +91,71 @@ dp.callback_query.register(mines_callback, lambda c: c.data.startswith("mines_")
 dp.callback_query.register(towers_callback, lambda c: c.data.startswith("towers_"))
 
 
-async def main() -> None:
+_metrics_server = None
+
+
+@dp.startup()
+async def on_startup(bot: Bot, worker: int = 0) -> None:
+    global _metrics_server
+    # The governor goes first, so API timings only cover the requests themselves.
+    bot.session.middleware(governor)
+    bot.session.middleware(metrics.request_timing)
+    if metrics.METRICS_PORT:
+        # Each webhook worker gets its own port so every process is scraped.
+        _metrics_server = await metrics.start_server(port=metrics.METRICS_PORT + worker)
     await init_db()
-    bot = Bot(token=TOKEN, default=DefaultBotProperties())
-    await dp.start_polling(bot)
+    # Only one process may own the resumable background jobs.
+    if worker == 0:
+        await resume_broadcasts(bot)
+        snapshots.start()
+    random_texts.start()
+    fairness.start()
+
+
+@dp.shutdown()
+async def on_shutdown() -> None:
+    if _metrics_server is not None:
+        await _metrics_server.cleanup()
+    await random_texts.stop()
+    await snapshots.stop()
+    await fairness.stop()
+    await tables.stop()
+    await close_session()
+    await close_db()
+
+
+def create_bot() -> Bot:
+    session = AiohttpSession(api=TelegramAPIServer.from_base(BOT_API_URL)) if BOT_API_URL else None
+    return Bot(token=TOKEN, session=session, default=DefaultBotProperties())
+
+
+def shard_worker(worker: int) -> None:
+    logging.basicConfig(level=logging.INFO, stream=sys.stdout)
+    try:
+        asyncio.run(sharding.stop_on_sigterm(webhook.serve(dp, create_bot(), worker, sharding.WORKER_HOST,
+                                                           sharding.worker_port(worker), sharding.worker_secret())))
+    except KeyboardInterrupt:
+        pass
+
+
+async def register_webhook() -> None:
+    bot = create_bot()
+    try:
+        await webhook.register_webhook(bot)
+    finally:
+        await bot.session.close()
+
+
+async def main() -> None:
+    await dp.start_polling(create_bot())
 
 
 if __name__ == "__main__":
     logging.basicConfig(level=logging.INFO, stream=sys.stdout)
-    asyncio.run(main())
\ No newline at end of file
+    if sharding.WORKERS > 1:
+        sharding.run(shard_worker, create_bot, BOT_MODE)
+    elif BOT_MODE == "webhook":
+        asyncio.run(register_webhook())
+        asyncio.run(webhook.serve(dp, create_bot()))
+    else:
+        asyncio.run(main())
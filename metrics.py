@@ -0,0 +1,202 @@
+import functools
+import time
+from bisect import bisect_left
+from os import getenv
+
+from aiohttp import web
+from aiogram import BaseMiddleware
+from aiogram.client.session.middlewares.base import BaseRequestMiddleware
+from aiogram.exceptions import TelegramAPIError, TelegramRetryAfter
+from aiogram.types import CallbackQuery, Message
+
+METRICS_HOST = getenv("METRICS_HOST", "127.0.0.1")
+METRICS_PORT = int(getenv("METRICS_PORT", "0"))
+
+CALLBACK_ACTIONS = {"cashout", "newgame", "noop"}
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+def _labels(names: tuple, values: tuple, extra: str = "") -> str:
+    pairs = [f'{name}="{value}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+class Counter:
+    def __init__(self, name: str, help_text: str, labels: tuple = ()):
+        self.name = name
+        self.help = help_text
+        self.labels = labels
+        self._values = {}
+
+    def inc(self, *labels, amount: float = 1.0) -> None:
+        self._values[labels] = self._values.get(labels, 0.0) + amount
+
+    def value(self, *labels) -> float:
+        return self._values.get(labels, 0.0)
+
+    def render(self) -> list:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        for labels, value in sorted(self._values.items()):
+            lines.append(f"{self.name}{_labels(self.labels, labels)} {value:g}")
+        return lines
+
+
+class Gauge:
+    def __init__(self, name: str, help_text: str, read):
+        self.name = name
+        self.help = help_text
+        self.read = read
+
+    def render(self) -> list:
+        return [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} gauge", f"{self.name} {self.read():g}"]
+
+
+class Histogram:
+    def __init__(self, name: str, help_text: str, labels: tuple = (), buckets: tuple = LATENCY_BUCKETS):
+        self.name = name
+        self.help = help_text
+        self.labels = labels
+        self.buckets = buckets
+        # labels -> [count per bucket (the last one is +Inf), sum]
+        self._series = {}
+
+    def observe(self, *labels, value: float) -> None:
+        series = self._series.get(labels)
+        if series is None:
+            series = self._series[labels] = [[0] * (len(self.buckets) + 1), 0.0]
+        series[0][bisect_left(self.buckets, value)] += 1
+        series[1] += value
+
+    def time(self, *labels):
+        return _Timer(self, labels)
+
+    def render(self) -> list:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        for labels, (counts, total) in sorted(self._series.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets + ("+Inf",), counts):
+                cumulative += count
+                le = bound if isinstance(bound, str) else f"{bound:g}"
+                bucket = _labels(self.labels, labels, f'le="{le}"')
+                lines.append(f"{self.name}_bucket{bucket} {cumulative}")
+            lines.append(f"{self.name}_sum{_labels(self.labels, labels)} {total:.6f}")
+            lines.append(f"{self.name}_count{_labels(self.labels, labels)} {cumulative}")
+        return lines
+
+
+class _Timer:
+    __slots__ = ("histogram", "labels", "start")
+
+    def __init__(self, histogram: Histogram, labels: tuple):
+        self.histogram = histogram
+        self.labels = labels
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.histogram.observe(*self.labels, value=time.perf_counter() - self.start)
+
+
+handler_seconds = Histogram("casino_handler_seconds", "Time spent in update handlers.", ("handler",))
+db_seconds = Histogram("casino_db_seconds", "Time spent in database calls, queueing included.", ("call",))
+api_seconds = Histogram("casino_bot_api_seconds", "Time spent in Bot API requests.", ("method",))
+api_errors = Counter("casino_bot_api_errors_total", "Failed Bot API requests.", ("method", "error"))
+rate_limited = Counter("casino_bot_api_429_total", "Bot API requests refused with 429 Too Many Requests.",
+                       ("method",))
+bets = Counter("casino_bets_total", "Bets accepted, use rate() for bets per second.")
+wagered = Counter("casino_wagered_total", "Sum of accepted bets in hundredths of a star.")
+
+_registry = [handler_seconds, db_seconds, api_seconds, api_errors, rate_limited, bets, wagered]
+
+
+def register(metric) -> None:
+    _registry.append(metric)
+
+
+def render() -> str:
+    lines = []
+    for metric in _registry:
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
+
+
+def timed_db(fn):
+    name = fn.__name__
+
+    @functools.wraps(fn)
+    async def wrapper(*args, **kwargs):
+        with db_seconds.time(name):
+            return await fn(*args, **kwargs)
+
+    return wrapper
+
+
+def record_bet(amount: float, count: int = 1) -> None:
+    bets.inc(amount=count)
+    wagered.inc(amount=amount)
+
+
+def message_label(message: Message) -> str:
+    if message.text and message.text.startswith("/"):
+        # "/roulette@casino_bot 10 red" -> "/roulette"
+        return message.text.split(maxsplit=1)[0].split("@", 1)[0]
+    return message.content_type
+
+
+def callback_label(callback: CallbackQuery) -> str:
+    # "mines_12" -> "mines_tile", "mines_cashout" -> "mines_cashout"
+    prefix, _, rest = (callback.data or "").partition("_")
+    if rest.isdigit():
+        return f"{prefix}_tile"
+    # Callback data can be forged by clients, so unknown actions share a label.
+    return f"{prefix}_{rest}" if rest in CALLBACK_ACTIONS else f"{prefix}_other"
+
+
+class HandlerTimingMiddleware(BaseMiddleware):
+    # Registered as an inner middleware, so it only sees events that matched
+    # a handler and the label set stays bounded.
+    async def __call__(self, handler, event, data):
+        if isinstance(event, Message):
+            label = message_label(event)
+        elif isinstance(event, CallbackQuery):
+            label = callback_label(event)
+        else:
+            label = type(event).__name__
+        with handler_seconds.time(label):
+            return await handler(event, data)
+
+
+class RequestTimingMiddleware(BaseRequestMiddleware):
+    async def __call__(self, make_request, bot, method):
+        name = method.__api_method__
+        start = time.perf_counter()
+        try:
+            return await make_request(bot, method)
+        except TelegramRetryAfter:
+            rate_limited.inc(name)
+            raise
+        except TelegramAPIError as e:
+            api_errors.inc(name, type(e).__name__)
+            raise
+        finally:
+            api_seconds.observe(name, value=time.perf_counter() - start)
+
+
+request_timing = RequestTimingMiddleware()
+
+
+async def handle_metrics(request: web.Request) -> web.Response:
+    return web.Response(text=render(), headers={"Content-Type": "text/plain; version=0.0.4; charset=utf-8"})
+
+
+async def start_server(host: str = METRICS_HOST, port: int = METRICS_PORT):
+    app = web.Application()
+    app.router.add_get("/metrics", handle_metrics)
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    await web.TCPSite(runner, host, port).start()
+    return runner
@@ -0,0 +1,174 @@
+import sqlite3
+import time
+
+from money import MINOR_UNITS, STARTING_BALANCE
+
+GAMES = ("roulette", "mines", "towers")
+
+
+def _ledger_table(conn: sqlite3.Connection, money_type: str) -> None:
+    conn.execute(f'''CREATE TABLE ledger (
+        id INTEGER PRIMARY KEY,
+        user_id INTEGER NOT NULL,
+        kind TEXT NOT NULL,
+        amount {money_type} NOT NULL,
+        balance {money_type} NOT NULL,
+        ref TEXT,
+        created_at INTEGER NOT NULL
+    )''')
+    conn.execute("CREATE INDEX idx_ledger_user ON ledger (user_id, id)")
+    for action in ("UPDATE", "DELETE"):
+        conn.execute(f"CREATE TRIGGER ledger_no_{action.lower()} BEFORE {action} ON ledger "
+                     "BEGIN SELECT RAISE(ABORT, 'ledger is append-only'); END")
+
+
+def _snapshot_tables(conn: sqlite3.Connection, money_type: str) -> None:
+    conn.execute('''CREATE TABLE balance_snapshots (
+        id INTEGER PRIMARY KEY,
+        ledger_id INTEGER NOT NULL,
+        created_at INTEGER NOT NULL
+    )''')
+    conn.execute(f'''CREATE TABLE snapshot_balances (
+        snapshot_id INTEGER NOT NULL,
+        user_id INTEGER NOT NULL,
+        balance {money_type} NOT NULL,
+        PRIMARY KEY (snapshot_id, user_id)
+    ) WITHOUT ROWID''')
+
+
+def _baseline(conn: sqlite3.Connection) -> None:
+    # The schema as init_db used to create it. Databases from before
+    # migrations already have some of these tables, hence IF NOT EXISTS.
+    conn.execute('''CREATE TABLE IF NOT EXISTS users (
+        id INTEGER PRIMARY KEY,
+        username TEXT,
+        name TEXT,
+        balance REAL DEFAULT 1000.0
+    )''')
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_users_balance ON users (balance)")
+    conn.execute('''CREATE TABLE IF NOT EXISTS broadcasts (
+        id INTEGER PRIMARY KEY,
+        text TEXT NOT NULL,
+        chat_id INTEGER NOT NULL,
+        message_id INTEGER,
+        total INTEGER NOT NULL,
+        last_user_id INTEGER NOT NULL DEFAULT 0,
+        sent INTEGER NOT NULL DEFAULT 0,
+        failed INTEGER NOT NULL DEFAULT 0,
+        status TEXT NOT NULL DEFAULT 'running'
+    )''')
+    if not conn.execute("SELECT 1 FROM sqlite_master WHERE name = 'ledger'").fetchone():
+        _ledger_table(conn, "REAL")
+        _snapshot_tables(conn, "REAL")
+    conn.execute('''CREATE TABLE IF NOT EXISTS fairness_seeds (
+        user_id INTEGER PRIMARY KEY,
+        server_seed TEXT NOT NULL,
+        client_seed TEXT NOT NULL,
+        nonce INTEGER NOT NULL DEFAULT 0
+    )''')
+    conn.execute('''CREATE TABLE IF NOT EXISTS fairness_reveals (
+        id INTEGER PRIMARY KEY,
+        user_id INTEGER NOT NULL,
+        server_seed TEXT NOT NULL,
+        client_seed TEXT NOT NULL,
+        nonces INTEGER NOT NULL,
+        revealed_at INTEGER NOT NULL
+    )''')
+    # Balances from before the ledger existed become its opening entries. A
+    # NaN balance was stored as NULL and opens at 0, as _integer_money sets it.
+    conn.execute("INSERT INTO ledger (user_id, kind, amount, balance, created_at) "
+                 "SELECT id, 'opening', COALESCE(balance, 0), COALESCE(balance, 0), ? FROM users "
+                 "WHERE NOT EXISTS (SELECT 1 FROM ledger)", (int(time.time()),))
+
+
+def _integer_money(conn: sqlite3.Connection) -> None:
+    to_minor = f"CAST(ROUND({{}} * {MINOR_UNITS}) AS INTEGER)"
+    conn.execute(f'''CREATE TABLE users_new (
+        id INTEGER PRIMARY KEY,
+        username TEXT,
+        name TEXT,
+        balance INTEGER NOT NULL DEFAULT {STARTING_BALANCE}
+    )''')
+    conn.execute(f"INSERT INTO users_new (id, username, name, balance) "
+                 f"SELECT id, username, name, {to_minor.format('COALESCE(balance, 0)')} FROM users")
+    conn.execute("DROP TABLE users")
+    conn.execute("ALTER TABLE users_new RENAME TO users")
+    # Covers the leaderboard page query, so OFFSET scans never touch the table.
+    conn.execute("CREATE INDEX idx_users_balance ON users (balance, name)")
+
+    conn.execute("ALTER TABLE ledger RENAME TO ledger_old")
+    conn.execute("DROP TRIGGER ledger_no_update")
+    conn.execute("DROP TRIGGER ledger_no_delete")
+    conn.execute("DROP INDEX idx_ledger_user")
+    _ledger_table(conn, "INTEGER")
+    conn.execute(f"INSERT INTO ledger (id, user_id, kind, amount, balance, ref, created_at) "
+                 f"SELECT id, user_id, kind, {to_minor.format('amount')}, {to_minor.format('balance')}, ref, "
+                 f"created_at FROM ledger_old")
+    conn.execute("DROP TABLE ledger_old")
+    # Rounding each row on its own can leave the sum a cent off the rounded
+    # balance; record the difference so the ledger still reconciles.
+    conn.execute("INSERT INTO ledger (user_id, kind, amount, balance, ref, created_at) "
+                 "SELECT users.id, 'adjustment', users.balance - COALESCE(totals.total, 0), users.balance, "
+                 "'integer migration', ? FROM users "
+                 "LEFT JOIN (SELECT user_id, SUM(amount) AS total FROM ledger GROUP BY user_id) AS totals "
+                 "ON totals.user_id = users.id WHERE users.balance != COALESCE(totals.total, 0)",
+                 (int(time.time()),))
+
+    # Snapshots are derived data, the next one is rebuilt from the ledger.
+    conn.execute("DROP TABLE snapshot_balances")
+    conn.execute("DROP TABLE balance_snapshots")
+    _snapshot_tables(conn, "INTEGER")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_fairness_reveals_user ON fairness_reveals (user_id)")
+
+
+def _backfill_stats(conn: sqlite3.Connection) -> None:
+    # One pass over the history from before game_stats existed. Batches and
+    # autoplay wrote a single bet entry, so each of them counts as one game
+    # and its biggest win is the whole credit. From here on the counters are
+    # kept exactly, which is why this only ever runs in the migration.
+    games = ", ".join("?" * len(GAMES))
+    conn.execute(f'''INSERT INTO game_stats (user_id, game, games, wagered, won, biggest_win)
+        SELECT user_id, ref,
+            SUM(kind = 'bet') - SUM(kind = 'refund'),
+            -SUM(CASE WHEN kind IN ('bet', 'refund') THEN amount ELSE 0 END),
+            SUM(CASE WHEN kind = 'win' THEN amount ELSE 0 END),
+            MAX(CASE WHEN kind = 'win' THEN amount ELSE 0 END)
+        FROM ledger WHERE ref IN ({games}) GROUP BY user_id, ref''', GAMES)
+    conn.execute('''INSERT INTO game_stats (user_id, game, games, wagered, won, biggest_win)
+        SELECT 0, game, SUM(games), SUM(wagered), SUM(won), MAX(biggest_win)
+        FROM game_stats GROUP BY game''')
+
+
+def _game_stats(conn: sqlite3.Connection) -> None:
+    # Running totals per player and game; user_id 0 holds everyone's.
+    conn.execute('''CREATE TABLE game_stats (
+        user_id INTEGER NOT NULL,
+        game TEXT NOT NULL,
+        games INTEGER NOT NULL DEFAULT 0,
+        wagered INTEGER NOT NULL DEFAULT 0,
+        won INTEGER NOT NULL DEFAULT 0,
+        biggest_win INTEGER NOT NULL DEFAULT 0,
+        PRIMARY KEY (user_id, game)
+    ) WITHOUT ROWID''')
+    _backfill_stats(conn)
+
+
+MIGRATIONS = [_baseline, _integer_money, _game_stats]
+
+
+def migrate(conn: sqlite3.Connection) -> int:
+    version = conn.execute("PRAGMA user_version").fetchone()[0]
+    if version >= len(MIGRATIONS):
+        return version
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        # Another worker may have migrated while this one waited for the lock.
+        version = conn.execute("PRAGMA user_version").fetchone()[0]
+        for number, migration in enumerate(MIGRATIONS[version:], version + 1):
+            migration(conn)
+            conn.execute(f"PRAGMA user_version = {number}")
+        conn.execute("COMMIT")
+    except BaseException:
+        conn.execute("ROLLBACK")
+        raise
+    return len(MIGRATIONS)
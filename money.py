@@ -0,0 +1,30 @@
+from decimal import Decimal, InvalidOperation
+
+# Balances, bets and ledger amounts are integers in hundredths of a star.
+MINOR_UNITS = 100
+STARTING_BALANCE = 1000 * MINOR_UNITS
+# Keeps every amount, and any sum of a few of them, inside SQLite's int64.
+MAX_AMOUNT = 10 ** 15
+
+
+def parse_amount(text: str) -> int:
+    try:
+        value = Decimal(text) * MINOR_UNITS
+    except InvalidOperation:
+        raise ValueError(f"Invalid amount: {text}")
+    if not value.is_finite() or value != value.to_integral_value() or abs(value) > MAX_AMOUNT:
+        raise ValueError(f"Invalid amount: {text}")
+    return int(value)
+
+
+def format_amount(amount: int) -> str:
+    whole, cents = divmod(abs(amount), MINOR_UNITS)
+    sign = "-" if amount < 0 else ""
+    return f"{sign}{whole}.{cents:02d}" if cents else f"{sign}{whole}"
+
+
+def stars(amount: int, signed: bool = False) -> str:
+    text = format_amount(amount)
+    if text.startswith("-"):
+        return f"-⭐{text[1:]}"
+    return f"+⭐{text}" if signed and amount > 0 else f"⭐{text}"
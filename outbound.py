@@ -0,0 +1,177 @@
+import asyncio
+import itertools
+import logging
+from collections import OrderedDict
+from contextlib import contextmanager
+from contextvars import ContextVar
+from os import getenv
+
+from aiogram.client.session.middlewares.base import BaseRequestMiddleware
+from aiogram.exceptions import TelegramBadRequest, TelegramRetryAfter
+from aiogram.types import Message
+
+from metrics import Counter, register
+from ratelimit import TokenBucket, BucketMap, chat_rate, GLOBAL_RATE
+
+OUTBOUND_GLOBAL_RATE = float(getenv("OUTBOUND_GLOBAL_RATE", str(GLOBAL_RATE)))
+OUTBOUND_CHAT_BURST = float(getenv("OUTBOUND_CHAT_BURST", "3"))
+OUTBOUND_MAX_RETRY_AFTER = float(getenv("OUTBOUND_MAX_RETRY_AFTER", "60"))
+OUTBOUND_TRACKED_MESSAGES = int(getenv("OUTBOUND_TRACKED_MESSAGES", "50000"))
+OUTBOUND_ATTEMPTS = 3
+
+EDIT_METHODS = {"editMessageText", "editMessageReplyMarkup"}
+SEND_PREFIXES = ("send", "edit", "copy", "forward")
+UNPACED_METHODS = {"sendChatAction"}
+
+FINAL, FRAME = 0, 1
+_priority = ContextVar("outbound_priority", default=FINAL)
+
+logger = logging.getLogger(__name__)
+
+skipped = Counter("casino_outbound_skipped_total", "Edits never sent because they changed nothing or were "
+                  "replaced by a newer edit.", ("reason",))
+retried = Counter("casino_outbound_retry_after_total", "429 responses absorbed by waiting and retrying.")
+register(skipped)
+register(retried)
+
+
+@contextmanager
+def low_priority():
+    # Requests made inside yield to final results waiting for the same tokens.
+    token = _priority.set(FRAME)
+    try:
+        yield
+    finally:
+        _priority.reset(token)
+
+
+def _markup_hash(markup):
+    return hash(markup.model_dump_json(exclude_none=True)) if markup is not None else None
+
+
+def _content(method, previous: tuple):
+    # (text, keyboard) as they will look after the request, None if unknown.
+    if method.__api_method__ == "editMessageReplyMarkup":
+        return (previous[0] if previous else None), _markup_hash(method.reply_markup)
+    return hash((method.text, str(method.parse_mode))), _markup_hash(method.reply_markup)
+
+
+class _MessageState:
+    __slots__ = ("content", "pending", "lock")
+
+    def __init__(self):
+        self.content = None
+        self.pending = 0
+        self.lock = asyncio.Lock()
+
+
+class OutboundGovernor(BaseRequestMiddleware):
+    def __init__(self, global_rate: float = OUTBOUND_GLOBAL_RATE, chat_burst: float = OUTBOUND_CHAT_BURST,
+                 tracked: int = OUTBOUND_TRACKED_MESSAGES):
+        self.paced = global_rate > 0
+        self._global = TokenBucket(global_rate or 1.0)
+        self._chats = BucketMap(chat_rate, capacity=chat_burst)
+        self.tracked = tracked
+        self._messages = OrderedDict()
+        self._sequence = itertools.count(1)
+        # Final results currently waiting for tokens, frames hold back for them.
+        self._waiting = 0
+
+    def _message(self, key: tuple) -> _MessageState:
+        state = self._messages.get(key)
+        if state is None:
+            state = self._messages[key] = _MessageState()
+            while len(self._messages) > self.tracked:
+                self._messages.popitem(last=False)
+        else:
+            self._messages.move_to_end(key)
+        return state
+
+    def _try_spend(self, chat) -> bool:
+        if self._global.delay() > 0 or (chat is not None and chat.delay() > 0):
+            return False
+        return self._global.try_acquire() and (chat is None or chat.try_acquire())
+
+    async def _acquire(self, chat_id, stale) -> bool:
+        chat = self._chats.get(chat_id) if chat_id is not None else None
+        final = _priority.get() == FINAL
+        if final:
+            self._waiting += 1
+        try:
+            while not stale():
+                if (final or not self._waiting) and self._try_spend(chat):
+                    return True
+                wait = max(self._global.delay(), chat.delay() if chat is not None else 0.0)
+                await asyncio.sleep(wait or 1 / self._global.rate)
+            return False
+        finally:
+            if final:
+                self._waiting -= 1
+
+    def _back_off(self, chat_id, seconds: float) -> None:
+        # A flood wait applies to the whole bot, so everyone backs off.
+        self._global.pause(seconds)
+        if chat_id is not None:
+            self._chats.get(chat_id).pause(seconds)
+
+    async def _send(self, make_request, bot, method, chat_id, stale=lambda: False):
+        paced = self.paced and method.__api_method__ not in UNPACED_METHODS
+        for attempt in range(OUTBOUND_ATTEMPTS):
+            if paced and not await self._acquire(chat_id, stale):
+                return None
+            try:
+                return await make_request(bot, method)
+            except TelegramRetryAfter as e:
+                if attempt == OUTBOUND_ATTEMPTS - 1 or e.retry_after > OUTBOUND_MAX_RETRY_AFTER:
+                    raise
+                retried.inc()
+                logger.warning("%s hit a flood wait of %ss, retrying", method.__api_method__, e.retry_after)
+                self._back_off(chat_id, e.retry_after)
+                if not paced:
+                    await asyncio.sleep(e.retry_after)
+
+    async def _edit(self, make_request, bot, method, chat_id):
+        state = self._message((chat_id, method.message_id))
+        sequence = state.pending = next(self._sequence)
+
+        def stale() -> bool:
+            return state.pending != sequence
+
+        # One request per message at a time, so edits land in the order they were made.
+        async with state.lock:
+            if stale():
+                skipped.inc("superseded")
+                return True
+            content = _content(method, state.content)
+            if content == state.content:
+                skipped.inc("unchanged")
+                return True
+            try:
+                result = await self._send(make_request, bot, method, chat_id, stale)
+            except TelegramBadRequest as e:
+                if "message is not modified" not in e.message:
+                    raise
+                result = True
+            if result is None:
+                skipped.inc("superseded")
+                return True
+            state.content = content
+            return result
+
+    async def __call__(self, make_request, bot, method):
+        name = method.__api_method__
+        if not name.startswith(SEND_PREFIXES):
+            return await make_request(bot, method)
+        chat_id = getattr(method, "chat_id", None)
+        if not isinstance(chat_id, int):
+            chat_id = None
+        if name in EDIT_METHODS and chat_id is not None and method.message_id is not None:
+            return await self._edit(make_request, bot, method, chat_id)
+        result = await self._send(make_request, bot, method, chat_id)
+        if name == "sendMessage" and isinstance(result, Message):
+            # An edit straight after sending only goes out if it changes something.
+            self._message((result.chat.id, result.message_id)).content = _content(method, None)
+        return result
+
+
+governor = OutboundGovernor()
@@ -0,0 +1,95 @@
+import asyncio
+import os
+import sys
+import threading
+import time
+from collections import Counter
+from os import getenv
+
+PROFILE_INTERVAL = float(getenv("PROFILE_INTERVAL", "0.005"))
+PROFILE_MAX_SECONDS = float(getenv("PROFILE_MAX_SECONDS", "300"))
+
+# Leaf frames of threads that are parked waiting for work.
+IDLE_FRAMES = ("_worker (thread.py:", "wait (threading.py:", "select (selectors.py:")
+
+_ROOT = os.path.dirname(os.path.abspath(__file__)) + os.sep
+
+
+def _short_path(filename: str) -> str:
+    if filename.startswith(_ROOT):
+        return filename[len(_ROOT):]
+    marker = filename.rfind("site-packages" + os.sep)
+    if marker != -1:
+        return filename[marker + len("site-packages") + 1:]
+    return os.path.basename(filename)
+
+
+class SamplingProfiler:
+    def __init__(self, interval: float = PROFILE_INTERVAL):
+        self.interval = interval
+        self.running = False
+        self.samples = 0
+        self._names = {}
+
+    def _frame_name(self, code) -> str:
+        name = self._names.get(code)
+        if name is None:
+            name = self._names[code] = f"{code.co_name} ({_short_path(code.co_filename)}:{code.co_firstlineno})"
+        return name
+
+    def _sample(self, counts: Counter, own_ident: int) -> None:
+        threads = {thread.ident: thread.name for thread in threading.enumerate()}
+        for ident, frame in sys._current_frames().items():
+            if ident == own_ident:
+                continue
+            stack = []
+            while frame is not None:
+                stack.append(self._frame_name(frame.f_code))
+                frame = frame.f_back
+            stack.append(threads.get(ident, str(ident)))
+            stack.reverse()
+            counts[";".join(stack)] += 1
+
+    def _run(self, seconds: float) -> Counter:
+        counts = Counter()
+        own_ident = threading.get_ident()
+        deadline = time.monotonic() + seconds
+        # Sampling from a separate thread leaves the event loop untouched, the
+        # only cost is the GIL being borrowed for a stack walk every interval.
+        while time.monotonic() < deadline:
+            self._sample(counts, own_ident)
+            self.samples += 1
+            time.sleep(self.interval)
+        return counts
+
+    async def profile(self, seconds: float) -> Counter:
+        if self.running:
+            raise RuntimeError("A profile is already running")
+        self.running = True
+        self.samples = 0
+        try:
+            return await asyncio.to_thread(self._run, seconds)
+        finally:
+            self.running = False
+
+
+def collapsed(counts: Counter) -> str:
+    # Brendan Gregg's folded format, ready for flamegraph.pl or speedscope.
+    return "".join(f"{stack} {count}\n" for stack, count in counts.most_common())
+
+
+def top_frames(counts: Counter, limit: int = 10) -> tuple:
+    leaves = Counter()
+    idle = 0
+    for stack, count in counts.items():
+        leaf = stack.rsplit(";", 1)[-1]
+        if leaf.startswith(IDLE_FRAMES):
+            idle += count
+        else:
+            leaves[leaf] += count
+    busy = sum(leaves.values())
+    total = busy + idle or 1
+    return [(frame, count / total) for frame, count in leaves.most_common(limit)], busy / total
+
+
+profiler = SamplingProfiler()
@@ -0,0 +1,78 @@
+import asyncio
+import time
+
+# Telegram's documented limits for bots: about 30 messages per second overall,
+# one message per second in a single chat and 20 per minute in a group.
+GLOBAL_RATE = 30.0
+CHAT_RATE = 1.0
+GROUP_RATE = 20 / 60
+
+
+class TokenBucket:
+    def __init__(self, rate: float, capacity: float = None):
+        self.rate = rate
+        self.capacity = capacity if capacity is not None else max(rate, 1.0)
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._paused_until = 0.0
+
+    def _refill(self, now: float) -> None:
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def try_acquire(self, tokens: float = 1.0) -> bool:
+        now = time.monotonic()
+        if now < self._paused_until:
+            return False
+        self._refill(now)
+        if self._tokens >= tokens:
+            self._tokens -= tokens
+            return True
+        return False
+
+    def delay(self, tokens: float = 1.0) -> float:
+        now = time.monotonic()
+        self._refill(now)
+        wait = max(0.0, (tokens - self._tokens) / self.rate)
+        return max(wait, self._paused_until - now)
+
+    async def acquire(self, tokens: float = 1.0) -> None:
+        while not self.try_acquire(tokens):
+            await asyncio.sleep(self.delay(tokens))
+
+    def pause(self, seconds: float) -> None:
+        self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+        self._tokens = 0.0
+
+    @property
+    def idle(self) -> bool:
+        self._refill(time.monotonic())
+        return self._tokens >= self.capacity and time.monotonic() >= self._paused_until
+
+
+def chat_rate(chat_id: int) -> float:
+    return GROUP_RATE if chat_id < 0 else CHAT_RATE
+
+
+class BucketMap:
+    def __init__(self, rate_for=chat_rate, capacity: float = 1.0, max_size: int = 10000):
+        self.rate_for = rate_for
+        self.capacity = capacity
+        self.max_size = max_size
+        self._buckets = {}
+
+    def get(self, key) -> TokenBucket:
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            if len(self._buckets) >= self.max_size:
+                self._prune()
+            bucket = self._buckets[key] = TokenBucket(self.rate_for(key), self.capacity)
+        return bucket
+
+    def _prune(self) -> None:
+        # A full bucket behaves exactly like a fresh one, so it can go.
+        for key in [key for key, bucket in self._buckets.items() if bucket.idle]:
+            del self._buckets[key]
+
+    def __len__(self) -> int:
+        return len(self._buckets)
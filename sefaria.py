@@ -0,0 +1,85 @@
+import asyncio
+import logging
+import time
+from collections import deque
+from os import getenv
+
+from http_client import get_session
+
+SEFARIA_URL = getenv("SEFARIA_URL", "https://www.sefaria.org/api/texts/random?categories=Mishnah")
+RANDOM_TEXT_POOL_SIZE = int(getenv("RANDOM_TEXT_POOL_SIZE", "20"))
+RANDOM_TEXT_TTL = float(getenv("RANDOM_TEXT_TTL", "3600"))
+REFILL_CONCURRENCY = 4
+RETRY_DELAY = 5.0
+
+logger = logging.getLogger(__name__)
+
+
+class RandomTextPool:
+    def __init__(self, url: str, size: int, ttl: float):
+        self.url = url
+        self.size = size
+        self.ttl = ttl
+        self._texts = deque()
+        self._wanted = None
+        self._task = None
+
+    async def _fetch(self):
+        async with get_session().get(self.url) as response:
+            response.raise_for_status()
+            data = await response.json(content_type=None)
+        return time.monotonic(), data["text"], data["ref"]
+
+    def _expire(self) -> None:
+        deadline = time.monotonic() - self.ttl
+        while self._texts and self._texts[0][0] < deadline:
+            self._texts.popleft()
+
+    async def _refill(self) -> None:
+        while True:
+            self._expire()
+            missing = self.size - len(self._texts)
+            if missing <= 0:
+                self._wanted.clear()
+                timeout = self._texts[0][0] + self.ttl - time.monotonic() if self._texts else None
+                try:
+                    await asyncio.wait_for(self._wanted.wait(), timeout)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+            results = await asyncio.gather(
+                *(self._fetch() for _ in range(min(missing, REFILL_CONCURRENCY))),
+                return_exceptions=True
+            )
+            fetched = [result for result in results if not isinstance(result, BaseException)]
+            self._texts.extend(fetched)
+            if len(fetched) < len(results):
+                logger.warning("Random text prefetch failed: %s", next(r for r in results if isinstance(r, BaseException)))
+                await asyncio.sleep(RETRY_DELAY)
+
+    def start(self) -> None:
+        if self._task is None:
+            self._wanted = asyncio.Event()
+            self._task = asyncio.create_task(self._refill())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def get(self):
+        self._expire()
+        if self._wanted is not None:
+            self._wanted.set()
+        if self._texts:
+            _, text, ref = self._texts.popleft()
+        else:
+            _, text, ref = await self._fetch()
+        return text, ref
+
+
+random_texts = RandomTextPool(SEFARIA_URL, RANDOM_TEXT_POOL_SIZE, RANDOM_TEXT_TTL)
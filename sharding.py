@@ -0,0 +1,270 @@
+import asyncio
+import json
+import logging
+import multiprocessing
+import os
+import secrets
+import signal
+from os import getenv
+
+import aiohttp
+from aiohttp import web
+from aiogram import Bot
+from aiogram.exceptions import TelegramAPIError
+
+import webhook
+
+WORKERS = int(getenv("WORKERS", "1"))
+WORKER_HOST = "127.0.0.1"
+WORKER_BASE_PORT = int(getenv("WORKER_BASE_PORT", "8100"))
+WORKER_START_TIMEOUT = float(getenv("WORKER_START_TIMEOUT", "120"))
+POLL_TIMEOUT = 30
+FORWARD_ATTEMPTS = 3
+GROUP_CHATS = {"group", "supergroup"}
+TABLE_COMMANDS = ("/roulette",)
+# Commands whose jobs only worker 0 runs and resumes after a restart.
+WORKER_ZERO_COMMANDS = ("/admin_broadcast",)
+
+logger = logging.getLogger(__name__)
+
+
+def update_user_id(update: dict):
+    # Every update type carries its payload under a single key, and nearly
+    # all of them have the acting user in "from".
+    for key, value in update.items():
+        if key == "update_id" or not isinstance(value, dict):
+            continue
+        user = value.get("from") or value.get("user")
+        if user:
+            return user["id"]
+        chat = value.get("chat") or (value.get("message") or {}).get("chat")
+        if chat:
+            return chat["id"]
+    return None
+
+
+def route_key(update: dict):
+    # Roulette table bets in a group have to meet in one process, and they
+    # touch no per-user memory, so they follow the chat instead of the user.
+    message = update.get("message") or {}
+    chat = message.get("chat") or {}
+    text = message.get("text") or ""
+    if chat.get("type") in GROUP_CHATS and text.startswith(TABLE_COMMANDS):
+        return chat["id"]
+    # A broadcast started elsewhere would be resumed a second time by worker 0
+    # whenever it restarts.
+    if text.startswith(WORKER_ZERO_COMMANDS):
+        return 0
+    return update_user_id(update)
+
+
+def worker_for(update: dict, workers: int = WORKERS) -> int:
+    # All updates of one user land on the same worker, so the games it keeps
+    # in memory stay consistent.
+    key = route_key(update)
+    return key % workers if key is not None else 0
+
+
+def worker_port(worker: int) -> int:
+    return WORKER_BASE_PORT + worker
+
+
+def worker_secret() -> str:
+    return os.environ["WORKER_SECRET"]
+
+
+class Router:
+    def __init__(self, workers: int, secret: str):
+        self.workers = workers
+        self.secret = secret
+        self._session = None
+
+    def _url(self, worker: int, path: str) -> str:
+        return f"http://{WORKER_HOST}:{worker_port(worker)}{path}"
+
+    async def start(self) -> None:
+        self._session = aiohttp.ClientSession(connector=aiohttp.TCPConnector(limit=0))
+
+    async def wait_ready(self, timeout: float = WORKER_START_TIMEOUT) -> None:
+        deadline = asyncio.get_running_loop().time() + timeout
+        for worker in range(self.workers):
+            while not await self.healthy(worker):
+                if asyncio.get_running_loop().time() > deadline:
+                    raise RuntimeError(f"Worker {worker} did not start")
+                await asyncio.sleep(0.5)
+
+    async def healthy(self, worker: int) -> bool:
+        try:
+            async with self._session.get(self._url(worker, "/healthz")) as response:
+                return response.status == 200
+        except aiohttp.ClientError:
+            return False
+
+    async def forward(self, update: dict, body: bytes = None) -> int:
+        worker = worker_for(update, self.workers)
+        if body is None:
+            body = json.dumps(update).encode()
+        headers = {"Content-Type": "application/json", "X-Telegram-Bot-Api-Secret-Token": self.secret}
+        for attempt in range(FORWARD_ATTEMPTS):
+            try:
+                async with self._session.post(self._url(worker, webhook.WEBHOOK_PATH), data=body,
+                                              headers=headers) as response:
+                    return response.status
+            except aiohttp.ClientError as e:
+                logger.warning("Forwarding update %s to worker %s failed: %s", update.get("update_id"), worker, e)
+                await asyncio.sleep(0.5 * (attempt + 1))
+        return 503
+
+    async def close(self) -> None:
+        if self._session is not None:
+            await self._session.close()
+
+
+async def _serve_front(router: Router) -> None:
+    app = web.Application(client_max_size=webhook.WEBHOOK_MAX_BODY)
+
+    async def health(request: web.Request) -> web.Response:
+        workers = [await router.healthy(worker) for worker in range(router.workers)]
+        return web.json_response({"status": "ok" if all(workers) else "degraded", "workers": workers},
+                                 status=200 if all(workers) else 503)
+
+    async def receive(request: web.Request) -> web.Response:
+        if webhook.WEBHOOK_SECRET and request.headers.get("X-Telegram-Bot-Api-Secret-Token") != webhook.WEBHOOK_SECRET:
+            return web.Response(status=401)
+        body = await request.read()
+        try:
+            update = json.loads(body)
+        except ValueError:
+            return web.Response(status=400)
+        # Anything but 200 makes Telegram redeliver the update later.
+        status = await router.forward(update, body)
+        return web.Response(status=200 if status == 200 else 503)
+
+    app.router.add_get("/healthz", health)
+    app.router.add_post(webhook.WEBHOOK_PATH, receive)
+    runner = web.AppRunner(app, keepalive_timeout=webhook.WEBHOOK_KEEPALIVE)
+    await runner.setup()
+    await web.TCPSite(runner, webhook.WEBHOOK_HOST, webhook.WEBHOOK_PORT).start()
+    logger.info("Routing webhook on %s:%s%s to %s workers", webhook.WEBHOOK_HOST, webhook.WEBHOOK_PORT,
+                webhook.WEBHOOK_PATH, router.workers)
+    try:
+        await asyncio.Event().wait()
+    finally:
+        await runner.cleanup()
+
+
+async def _poll_front(bot: Bot, router: Router) -> None:
+    offset = None
+    # Updates past a failed one that were already delivered, so polling again
+    # from the failed update does not hand them to a worker twice.
+    delivered = set()
+    logger.info("Polling updates for %s workers", router.workers)
+    while True:
+        try:
+            updates = await bot.get_updates(offset=offset, timeout=POLL_TIMEOUT)
+        except TelegramAPIError as e:
+            logger.warning("Polling failed: %s", e)
+            await asyncio.sleep(1)
+            continue
+        if not updates:
+            continue
+        payloads = [update.model_dump(mode="json", by_alias=True, exclude_none=True) for update in updates]
+        payloads = [payload for payload in payloads if payload["update_id"] not in delivered]
+        statuses = await asyncio.gather(*(router.forward(payload) for payload in payloads))
+        failed = None
+        for payload, status in zip(payloads, statuses):
+            if status == 200:
+                delivered.add(payload["update_id"])
+            else:
+                logger.error("Worker rejected update %s with %s", payload["update_id"], status)
+                if failed is None:
+                    failed = payload
+        if failed is None:
+            offset = updates[-1].update_id + 1
+            delivered.clear()
+            continue
+        # Telegram forgets every update before the offset, so it stops at the
+        # first one that did not reach its worker and waits for that worker.
+        offset = failed["update_id"]
+        delivered = {update_id for update_id in delivered if update_id > offset}
+        worker = worker_for(failed, router.workers)
+        while not await router.healthy(worker):
+            await asyncio.sleep(1)
+        await asyncio.sleep(1)
+
+
+async def _supervise(processes: list, spawn) -> None:
+    while True:
+        await asyncio.sleep(1)
+        for worker, process in enumerate(processes):
+            if not process.is_alive():
+                logger.error("Worker %s exited with %s, restarting", worker, process.exitcode)
+                processes[worker] = spawn(worker)
+
+
+async def _front(mode: str, create_bot, processes: list, spawn) -> None:
+    router = Router(len(processes), worker_secret())
+    await router.start()
+    bot = create_bot()
+    try:
+        await router.wait_ready()
+        supervisor = asyncio.create_task(_supervise(processes, spawn))
+        try:
+            if mode == "webhook":
+                await webhook.register_webhook(bot)
+                await _serve_front(router)
+            else:
+                await bot.delete_webhook()
+                await _poll_front(bot, router)
+        finally:
+            supervisor.cancel()
+    finally:
+        await router.close()
+        await bot.session.close()
+
+
+async def stop_on_sigterm(coro) -> None:
+    # A plain `kill` cancels the running task, so `finally` blocks clean up as
+    # they would on Ctrl+C without an exception raised in the middle of them.
+    task = asyncio.current_task()
+    loop = asyncio.get_running_loop()
+    terminated = False
+
+    def terminate():
+        nonlocal terminated
+        terminated = True
+        task.cancel()
+
+    loop.add_signal_handler(signal.SIGTERM, terminate)
+    try:
+        await coro
+    except asyncio.CancelledError:
+        if not terminated:
+            raise
+    finally:
+        loop.remove_signal_handler(signal.SIGTERM)
+
+
+def run(worker_target, create_bot, mode: str, workers: int = WORKERS) -> None:
+    # Workers only accept updates from the front process on loopback ports.
+    os.environ.setdefault("WORKER_SECRET", secrets.token_hex(16))
+    context = multiprocessing.get_context("spawn")
+
+    def spawn(worker: int):
+        process = context.Process(target=worker_target, args=(worker,), daemon=True)
+        process.start()
+        return process
+
+    processes = [spawn(worker) for worker in range(workers)]
+    try:
+        asyncio.run(stop_on_sigterm(_front(mode, create_bot, processes, spawn)))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        for process in processes:
+            if process.is_alive():
+                process.terminate()
+        for process in processes:
+            process.join(10)
+            if process.is_alive():
+                process.kill()
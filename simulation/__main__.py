@@ -0,0 +1,27 @@
+import argparse
+
+import numpy as np
+
+from simulation import bench, rtp
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Monte Carlo RTP checks and benchmarks for the casino games.")
+    parser.add_argument("--rounds", type=int, default=2_000_000, help="rounds simulated per strategy")
+    parser.add_argument("--seed", type=int, default=None)
+    parser.add_argument("--bet", type=int, default=100, help="stake per round, payouts are truncated like in the bot")
+    parser.add_argument("--bench", action="store_true", help="time the real per-round code paths instead")
+    args = parser.parse_args()
+
+    if args.bench:
+        bench.run(args.rounds)
+        return
+
+    rng = np.random.default_rng(args.seed)
+    print(rtp.HEADER)
+    for fn, strategy in rtp.default_strategies():
+        print(fn(rng, *strategy, args.rounds, args.bet).row())
+
+
+if __name__ == "__main__":
+    main()
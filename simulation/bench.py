@@ -0,0 +1,71 @@
+import random
+import time
+import timeit
+
+import numpy as np
+
+from fairness import round_floats
+from games import mines, roulette, towers
+from simulation import rtp
+
+
+def _per_call(fn, number: int) -> float:
+    return min(timeit.repeat(fn, number=number, repeat=3)) / number
+
+
+# Games draw pre-generated floats from the fairness pool, so the request
+# path itself does no hashing.
+FLOATS = round_floats("bench-server-seed", "bench-client-seed", 0)
+
+
+def _mines_round():
+    # The session methods the callbacks call, so this follows the game as it changes.
+    session = mines.MinesSession(100, 5, mines.generate_board(5, FLOATS))
+    mines.create_mines_keyboard(session)
+    for tile in range(mines.TILES):
+        if not session.reveal(tile):
+            break
+        session.winnings
+        mines.create_mines_keyboard(session)
+
+
+def _towers_round():
+    session = towers.TowersSession(100, "medium", towers.generate_board("medium", FLOATS))
+    towers.create_towers_keyboard(session)
+    while session.floor >= 0:
+        if not session.climb(session.floor * session.columns + random.randrange(session.columns)):
+            break
+        session.winnings
+        towers.create_towers_keyboard(session)
+
+
+def _roulette_round():
+    spin = roulette.spin_reel(FLOATS)
+    ["".join(spin[i:i+9]) + "\n➖➖➖➖🔺➖➖➖➖" for i in range(16)]
+
+
+def _fair_round():
+    round_floats("bench-server-seed", "bench-client-seed", 1)
+
+
+CODE_PATHS = {
+    "mines round (start + clicks)": _mines_round,
+    "towers round (start + floors)": _towers_round,
+    "roulette spin + frames": _roulette_round,
+    "fairness HMACs (background)": _fair_round
+}
+
+
+def run(rounds: int = 2_000_000, number: int = 2000) -> None:
+    print("Real per-round code paths")
+    for name, fn in CODE_PATHS.items():
+        per_call = _per_call(fn, number)
+        print(f"  {name:<32} {per_call * 1e6:>9.2f} µs   {1 / per_call:>12,.0f} rounds/s")
+
+    print("\nSimulator throughput")
+    rng = np.random.default_rng()
+    for fn, args in ((rtp.roulette, ("red",)), (rtp.mines, (5, 3)), (rtp.towers, ("hard", 3))):
+        start = time.perf_counter()
+        result = fn(rng, *args, rounds)
+        elapsed = time.perf_counter() - start
+        print(f"  {result.name:<32} {rounds / elapsed:>12,.0f} rounds/s")
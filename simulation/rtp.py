@@ -0,0 +1,103 @@
+import math
+from math import comb
+
+import numpy as np
+
+from games.roulette import config as roulette_config
+from games.mines import MULTIPLIERS, TILES
+from games.towers import DIFFICULTIES, FLOOR_MULTIPLIERS
+
+CHUNK = 1_000_000
+Z_95 = 1.959963984540054
+
+COLORS = ["red", "black", "yellow"]
+
+
+class Result:
+    def __init__(self, name: str, rounds: int, total: float, total_sq: float, expected: float, bet: int):
+        self.name = name
+        self.rounds = rounds
+        self.rtp = total / rounds
+        self.variance = max(total_sq / rounds - self.rtp ** 2, 0.0)
+        self.margin = Z_95 * math.sqrt(self.variance / rounds)
+        self.expected = expected
+        self.bet = bet
+
+    @property
+    def house_edge(self) -> float:
+        return 1 - self.rtp
+
+    def row(self) -> str:
+        return (f"{self.name:<28} {self.rtp:>8.4f} ±{self.margin:<7.4f} {self.expected:>8.4f} "
+                f"{self.variance:>10.4f} {self.house_edge:>+8.4f}")
+
+
+HEADER = f"{'strategy':<28} {'rtp':>8} {'95% ci':<8} {'exact':>8} {'variance':>10} {'edge':>8}"
+
+
+def _run(name: str, rounds: int, bet: int, expected: float, draw) -> Result:
+    total = 0.0
+    total_sq = 0.0
+    done = 0
+    while done < rounds:
+        n = min(CHUNK, rounds - done)
+        # Returns as a fraction of the stake: 0 for a loss, payout / bet otherwise.
+        returns = draw(n) / bet
+        total += float(returns.sum())
+        total_sq += float(np.square(returns).sum())
+        done += n
+    return Result(name, rounds, total, total_sq, expected, bet)
+
+
+def roulette(rng: np.random.Generator, color: str, rounds: int, bet: int = 100) -> Result:
+    weights = np.array([roulette_config[f"{c}_probability"] for c in COLORS])
+    weights = weights / weights.sum()
+    index = COLORS.index(color)
+    payout = bet * roulette_config[f"{color}_coefficient"]
+
+    def draw(n):
+        return np.where(rng.choice(len(COLORS), size=n, p=weights) == index, payout, 0)
+
+    return _run(f"roulette {color}", rounds, bet, weights[index] * payout / bet, draw)
+
+
+def mines_payout(bet: int, mines: int, reveals: int) -> int:
+    if not reveals:
+        return bet
+    return int(bet * MULTIPLIERS[mines][reveals])
+
+
+def mines(rng: np.random.Generator, mines: int, reveals: int, rounds: int, bet: int = 100) -> Result:
+    payout = mines_payout(bet, mines, reveals)
+    survive = comb(TILES - mines, reveals) / comb(TILES, reveals)
+
+    def draw(n):
+        # Picking `reveals` distinct tiles from a shuffled board hits a
+        # hypergeometric number of mines.
+        hits = rng.hypergeometric(mines, TILES - mines, reveals, size=n) if reveals else np.zeros(n)
+        return np.where(hits == 0, payout, 0)
+
+    return _run(f"mines m={mines} cashout@{reveals}", rounds, bet, survive * payout / bet, draw)
+
+
+def towers(rng: np.random.Generator, difficulty: str, floors: int, rounds: int, bet: int = 100) -> Result:
+    config = DIFFICULTIES[difficulty]
+    safe = (config["columns"] - config["bombs"]) / config["columns"]
+    payout = int(bet * FLOOR_MULTIPLIERS[difficulty][floors])
+
+    def draw(n):
+        return np.where(rng.binomial(floors, safe, size=n) == floors, payout, 0)
+
+    return _run(f"towers {difficulty} floor {floors}", rounds, bet, safe ** floors * payout / bet, draw)
+
+
+def default_strategies():
+    for color in COLORS:
+        yield roulette, (color,)
+    for mine_count in (1, 3, 5, 10, 20):
+        for reveals in (1, 3, 5, 10):
+            if reveals <= TILES - mine_count:
+                yield mines, (mine_count, reveals)
+    for difficulty in DIFFICULTIES:
+        for floors in range(1, len(FLOOR_MULTIPLIERS[difficulty])):
+            yield towers, (difficulty, floors)
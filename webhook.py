@@ -0,0 +1,50 @@
+import asyncio
+import logging
+import os
+from os import getenv
+
+from aiohttp import web
+from aiogram import Bot, Dispatcher
+from aiogram.webhook.aiohttp_server import SimpleRequestHandler, setup_application
+
+WEBHOOK_URL = getenv("WEBHOOK_URL", "")
+WEBHOOK_PATH = getenv("WEBHOOK_PATH", "/webhook")
+WEBHOOK_SECRET = getenv("WEBHOOK_SECRET") or None
+WEBHOOK_HOST = getenv("WEBHOOK_HOST", "127.0.0.1")
+WEBHOOK_PORT = int(getenv("WEBHOOK_PORT", "8080"))
+WEBHOOK_KEEPALIVE = float(getenv("WEBHOOK_KEEPALIVE", "75"))
+WEBHOOK_MAX_BODY = int(getenv("WEBHOOK_MAX_BODY", str(1024 * 1024)))
+
+logger = logging.getLogger(__name__)
+
+
+def build_app(dp: Dispatcher, bot: Bot, worker: int = 0, secret: str = WEBHOOK_SECRET) -> web.Application:
+    app = web.Application(client_max_size=WEBHOOK_MAX_BODY)
+
+    async def health(request: web.Request) -> web.Response:
+        return web.json_response({"status": "ok", "worker": worker, "pid": os.getpid()})
+
+    app.router.add_get("/healthz", health)
+    SimpleRequestHandler(dispatcher=dp, bot=bot, secret_token=secret).register(app, path=WEBHOOK_PATH)
+    setup_application(app, dp, bot=bot, worker=worker)
+    return app
+
+
+async def serve(dp: Dispatcher, bot: Bot, worker: int = 0, host: str = WEBHOOK_HOST, port: int = WEBHOOK_PORT,
+                secret: str = WEBHOOK_SECRET) -> None:
+    runner = web.AppRunner(build_app(dp, bot, worker, secret), keepalive_timeout=WEBHOOK_KEEPALIVE)
+    await runner.setup()
+    await web.TCPSite(runner, host, port).start()
+    logger.info("Worker %s serving webhook on %s:%s%s", worker, host, port, WEBHOOK_PATH)
+    try:
+        await asyncio.Event().wait()
+    finally:
+        await runner.cleanup()
+        await bot.session.close()
+
+
+async def register_webhook(bot: Bot) -> None:
+    if not WEBHOOK_URL:
+        logger.warning("WEBHOOK_URL is not set, leaving the current webhook untouched")
+        return
+    await bot.set_webhook(f"{WEBHOOK_URL.rstrip('/')}{WEBHOOK_PATH}", secret_token=WEBHOOK_SECRET)